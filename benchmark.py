@@ -0,0 +1,423 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import zipfile
+import argparse
+import tempfile
+import threading
+import subprocess
+import contextlib
+import httpx
+import psutil
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+SECRET = 'bench'
+THRESHOLD = 0.10  # relative change from the baseline counted as a regression
+# Results go here; in-process runs send the API's own output to /dev/null
+report = sys.stdout
+
+STUB_SERVER = '''
+import sys, time, threading
+interval = float(sys.argv[2])
+log = open('logs/latest.log', 'a')
+lock = threading.Lock()
+
+def emit(message, level='INFO'):
+    line = f'[{time.strftime("%H:%M:%S")}] [Server thread/{level}]: {message}\\n'
+    with lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        log.write(line)
+        log.flush()
+
+def tick():
+    n = 0
+    while True:
+        n += 1
+        emit(f'Tick {n}', 'WARN' if n % 50 == 0 else 'INFO')
+        time.sleep(interval)
+
+emit('Done (0.1s)! For help, type "help"')
+threading.Thread(target=tick, daemon=True).start()
+for line in sys.stdin:
+    command = line.strip()
+    if command == 'save-all':
+        emit('Saved the game')
+    elif command == 'stop':
+        emit('Stopping the server')
+        break
+    elif command:
+        emit(f'Unknown command: {command}')
+'''
+
+SERVE = '''
+import sys
+sys.path.insert(0, {repo!r})
+import uvicorn
+import main
+from betternos.scheduler import scheduler
+scheduler.stagger = 0
+uvicorn.run(main.app, host='127.0.0.1', port=int(sys.argv[1]), log_level='warning')
+'''
+
+LEVELS = ['INFO'] * 8 + ['WARN', 'ERROR']
+
+
+def make_log(path, size):
+    """
+    Write a latest.log of about `size` bytes of Minecraft-style lines.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    n = 0
+    with open(path, 'w') as f:
+        while written < size:
+            block = []
+            for _ in range(1000):
+                n += 1
+                block.append(f'[{n // 3600 % 24:02}:{n // 60 % 60:02}:{n % 60:02}] [Server thread/{LEVELS[n % len(LEVELS)]}]: Player{n % 97} moved to {n % 1000}, 64, {n % 777} (line {n})\n')
+            chunk = ''.join(block)
+            f.write(chunk)
+            written += len(chunk)
+
+
+def make_tree(root, files, file_size):
+    """
+    Create a world-like directory tree of random region files and configs.
+    """
+    with open(f'{root}/server.properties', 'w') as f:
+        f.write(''.join(f'option-{i}=value-{i}\n' for i in range(200)))
+    for i in range(files):
+        folder = f'{root}/world/region' if i % 4 else f'{root}/plugins/plugin{i % 10}'
+        os.makedirs(folder, exist_ok=True)
+        with open(f'{folder}/r.{i}.{i % 7}.mca', 'wb') as f:
+            f.write(random.randbytes(file_size))
+
+
+def make_zip(path, files, file_size):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for i in range(files):
+            z.writestr(f'pack/data{i}.txt', ('x' * 63 + '\n') * (file_size // 64))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class PeakRSS:
+    """
+    Samples the RSS of a process in a thread and keeps the peak.
+    """
+
+    def __init__(self, pid, interval=0.01):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak = 0
+        self.running = False
+        self.thread = None
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+
+    def _sample(self):
+        while self.running:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+
+async def run_case(send, names, count, concurrency):
+    """
+    Call send(i, name) `count` times with `concurrency` calls in flight,
+    spreading the calls over the servers.
+    """
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < count:
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                ok = await send(i, names[i % len(names)])
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": count,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput": count / elapsed,
+    }
+
+
+def succeeded(response):
+    if response.status_code >= 400:
+        return False
+    return response.json().get('success', True) is not False
+
+
+def build_cases(client, zip_data, args):
+    """
+    The endpoints to benchmark, as name -> (request count, send function).
+    """
+    headers = {'secret': SECRET}
+    upload = random.randbytes(args.upload_kb * 1024)
+
+    async def get(path, params=None):
+        return succeeded(await client.get(path, params=params, headers=headers))
+
+    async def upload_file(i, name):
+        files = {'file': (f'bench-{i}.bin', upload)}
+        return succeeded(await client.post(f'/{name}/upload-file', files=files, headers=headers))
+
+    async def upload_extract(i, name):
+        files = {'file': ('pack.zip', zip_data)}
+        return succeeded(await client.post(f'/{name}/upload-file', files=files, data={'extract': 'true'}, headers=headers))
+
+    return {
+        'ping': (args.requests, lambda i, name: get(f'/{name}/ping')),
+        'get-status': (args.requests, lambda i, name: get(f'/{name}/get-status', {'lines': 100})),
+        'get-status-output': (args.requests, lambda i, name: get(f'/{name}/get-status', {'source': 'output'})),
+        'get-files-dir': (args.requests, lambda i, name: get(f'/{name}/get-files', {'path': '/world/region'})),
+        'get-files-file': (args.requests, lambda i, name: get(f'/{name}/get-files', {'path': '/server.properties'})),
+        'upload-file': (args.upload_requests, upload_file),
+        'upload-extract': (args.upload_requests, upload_extract),
+    }
+
+
+async def provision(client, workdir, home, args):
+    """
+    Create the fake servers with their files through the API and start them.
+    """
+    stub = f'{workdir}/stub_server.py'
+    with open(stub, 'w') as f:
+        f.write(STUB_SERVER)
+    names = [f'bench{i}' for i in range(args.servers)]
+    for name in names:
+        response = await client.post('/create-server', json={
+            'name': name, 'ip': '127.0.0.1', 'secret': SECRET,
+            # The -Xmx is only read by the scheduler's memory admission
+            'run_cmd': f'{sys.executable} {stub} -Xmx16M {args.tick}',
+        })
+        if not succeeded(response):
+            raise RuntimeError(f'Could not create server {name}: {response.text}')
+        root = f'{home}/{name}'
+        await asyncio.to_thread(make_log, f'{root}/logs/latest.log', args.log_mb * 1024 * 1024)
+        await asyncio.to_thread(make_tree, root, args.files, args.file_kb * 1024)
+    await asyncio.gather(*[
+        client.post(f'/{name}/start-server', headers={'secret': SECRET}) for name in names
+    ])
+    return names
+
+
+async def teardown(client, names):
+    await asyncio.gather(*[
+        client.post(f'/{name}/stop-server', params={'wait': 'true', 'timeout': 10}, headers={'secret': SECRET})
+        for name in names
+    ])
+
+
+async def run_cases(client, pid, names, zip_data, args, extra=None):
+    results = {}
+    cases = build_cases(client, zip_data, args)
+    cases.update(extra or {})
+    for case, (count, send) in cases.items():
+        if args.only and case not in args.only:
+            continue
+        with PeakRSS(pid) as rss:
+            result = await run_case(send, names, count, args.concurrency)
+        result['peak_rss_mb'] = rss.peak / 1024 ** 2
+        results[case] = result
+        print_row(case, result)
+    return results
+
+
+async def bench_in_process(workdir, home, zip_data, args):
+    """
+    Drive the app through an ASGI transport inside this process.
+    """
+    os.environ['HOME'] = home
+    os.chdir(workdir)
+    sys.path.insert(0, REPO)
+    import main
+    from betternos.scheduler import scheduler
+    from betternos.supervisor import supervisor
+    scheduler.stagger = 0
+
+    async def refresh(i, name):
+        await supervisor.rescan()
+        return True
+
+    quiet = open(os.devnull, 'w') if not args.verbose else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=60) as client:
+                names = await provision(client, workdir, home, args)
+                try:
+                    return await run_cases(client, os.getpid(), names, zip_data, args, {'refresh': (args.requests, refresh)})
+                finally:
+                    await teardown(client, names)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def bench_http(workdir, home, zip_data, args):
+    """
+    Drive a uvicorn process running the app over real HTTP connections.
+    """
+    serve = f'{workdir}/serve.py'
+    with open(serve, 'w') as f:
+        f.write(SERVE.format(repo=REPO))
+    port = free_port()
+    output = None if args.verbose else subprocess.DEVNULL
+    server = subprocess.Popen([sys.executable, serve, str(port)], cwd=workdir, env={**os.environ, 'HOME': home}, stdout=output)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits, timeout=60) as client:
+            for _ in range(100):
+                try:
+                    await client.get('/')
+                    break
+                except httpx.TransportError:
+                    if server.poll() is not None:
+                        raise RuntimeError('The API process exited; is uvicorn installed?')
+                    await asyncio.sleep(0.1)
+            names = await provision(client, workdir, home, args)
+            try:
+                return await run_cases(client, server.pid, names, zip_data, args)
+            finally:
+                await teardown(client, names)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def print_header():
+    print(f'{"case":<20} {"requests":>8} {"errors":>6} {"p50 ms":>9} {"p99 ms":>9} {"req/s":>9} {"peak RSS MB":>12}', file=report)
+
+
+def print_row(case, r):
+    print(f'{case:<20} {r["requests"]:>8} {r["errors"]:>6} {r["p50_ms"]:>9.2f} {r["p99_ms"]:>9.2f} {r["throughput"]:>9.1f} {r["peak_rss_mb"]:>12.1f}', file=report, flush=True)
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Print the change of every case against the baseline.
+    Returns the regressions found.
+    """
+    regressions = []
+    print(f'\n{"case":<20} {"p50":>8} {"p99":>8} {"req/s":>8} {"RSS":>8}')
+    for case, r in results.items():
+        base = baseline.get('cases', {}).get(case)
+        if base is None:
+            continue
+        changes = {
+            'p50_ms': r['p50_ms'] / base['p50_ms'] - 1,
+            'p99_ms': r['p99_ms'] / base['p99_ms'] - 1,
+            'throughput': r['throughput'] / base['throughput'] - 1,
+            'peak_rss_mb': r['peak_rss_mb'] / base['peak_rss_mb'] - 1,
+        }
+        print(f'{case:<20} ' + ' '.join(f'{changes[k]:>+8.1%}' for k in ('p50_ms', 'p99_ms', 'throughput', 'peak_rss_mb')))
+        for key, change in changes.items():
+            worse = -change if key == 'throughput' else change
+            if worse > threshold:
+                regressions.append(f'{case} {key} {change:+.1%}')
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the BetterNos API hot paths against stub servers.')
+    parser.add_argument('--http', action='store_true', help='run the app under uvicorn and benchmark over HTTP')
+    parser.add_argument('--servers', type=int, default=10, help='fake servers to provision')
+    parser.add_argument('--requests', type=int, default=500, help='requests per read endpoint')
+    parser.add_argument('--upload-requests', type=int, default=50, help='requests per upload endpoint')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight')
+    parser.add_argument('--log-mb', type=int, default=20, help='size of each latest.log')
+    parser.add_argument('--files', type=int, default=200, help='files in each server tree')
+    parser.add_argument('--file-kb', type=int, default=64, help='size of each file in the trees')
+    parser.add_argument('--zip-files', type=int, default=100, help='files in the uploaded archive')
+    parser.add_argument('--upload-kb', type=int, default=256, help='size of the uploaded file')
+    parser.add_argument('--tick', type=float, default=0.1, help='seconds between log lines of the stub servers')
+    parser.add_argument('--only', nargs='*', help='only run these cases')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the generated files')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the results to PATH')
+    parser.add_argument('--baseline', metavar='PATH', help='compare the results with PATH')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='relative change counted as a regression')
+    parser.add_argument('--keep', action='store_true', help='keep the work directory')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the API')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix='betternos-bench-')
+    home = f'{workdir}/home'
+    os.makedirs(home)
+    print(f'Work directory: {workdir}')
+    try:
+        make_zip(f'{workdir}/pack.zip', args.zip_files, 16 * 1024)
+        with open(f'{workdir}/pack.zip', 'rb') as f:
+            zip_data = f.read()
+        print_header()
+        bench = bench_http if args.http else bench_in_process
+        results = asyncio.run(bench(workdir, home, zip_data, args))
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = {
+        "mode": 'http' if args.http else 'in-process',
+        "servers": args.servers,
+        "concurrency": args.concurrency,
+        "time": time.time(),
+        "cases": results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f'Baseline written to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('mode') != summary['mode']:
+            print(f'Warning: the baseline was taken in {baseline.get("mode")} mode')
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\nRegressions:\n' + '\n'.join(f'  {r}' for r in regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
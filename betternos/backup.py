@@ -0,0 +1,301 @@
+import logging
+import os
+import json
+import stat
+import time
+import uuid
+import zlib
+import hashlib
+from contextlib import asynccontextmanager
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from betternos.process import get_process
+
+logger = logging.getLogger(__name__)
+
+BACKUP_CHUNK_SIZE = 1024 * 1024  # bytes per chunk; region files change in place, so fixed chunks line up
+BACKUP_WORKERS = os.cpu_count() or 1  # threads hashing and compressing files
+BACKUP_KEEP = 7  # snapshots kept per server by default
+BACKUP_COMPRESSION = 3  # zlib level for stored chunks
+BACKUP_SKIP = {'session.lock'}  # file names never backed up
+SAVE_TIMEOUT = 60  # seconds to wait for the server to flush the world before a backup
+SAVED_PATTERN = r'Saved the game'  # console line printed once save-all finishes
+
+# Held by garbage collection; backups take it to pin chunks they rely on
+gc_lock = threading.Lock()
+# Chunks used by backups in progress, by job id, kept by garbage collection
+pinned = {}
+
+
+def backup_dir():
+    return os.path.expanduser('~')+'/.betternos/backups'
+
+
+def chunk_path(digest):
+    return f'{backup_dir()}/chunks/{digest[:2]}/{digest}'
+
+
+def snapshot_dir(name):
+    return f'{backup_dir()}/snapshots/{name}'
+
+
+def load_snapshot(name, snapshot_id):
+    try:
+        with open(f'{snapshot_dir(name)}/{os.path.basename(snapshot_id)}.json') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_snapshots(name):
+    """
+    Get the snapshots of a server, newest first, without their file lists.
+    """
+    snapshots = []
+    try:
+        ids = [f[:-5] for f in os.listdir(snapshot_dir(name)) if f.endswith('.json')]
+    except FileNotFoundError:
+        return snapshots
+    for snapshot_id in ids:
+        snapshot = load_snapshot(name, snapshot_id)
+        if snapshot is not None:
+            snapshots.append({k: v for k, v in snapshot.items() if k != 'files'})
+    snapshots.sort(key=lambda s: s['created_at'], reverse=True)
+    return snapshots
+
+
+def store_file(path, lock, stats, pins):
+    """
+    Split a file into chunks and store the ones not yet in the store.
+    Returns the chunk digests.
+    """
+    digests = []
+    with open(path, 'rb') as f:
+        while chunk := f.read(BACKUP_CHUNK_SIZE):
+            digest = hashlib.sha256(chunk).hexdigest()
+            digests.append(digest)
+            target = chunk_path(digest)
+            with gc_lock:
+                pins.add(digest)
+                exists = os.path.exists(target)
+            if exists:
+                continue
+            data = zlib.compress(chunk, BACKUP_COMPRESSION)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+            with open(tmp, 'wb') as out:
+                out.write(data)
+            os.replace(tmp, target)
+            with lock:
+                stats['new_chunks'] += 1
+                stats['stored_bytes'] += len(data)
+    return digests
+
+
+def walk_files(root):
+    """
+    Yield (relative path, stat) for every regular file under root.
+    """
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename in BACKUP_SKIP:
+                continue
+            path = os.path.join(folder, filename)
+            st = os.lstat(path)
+            if stat.S_ISREG(st.st_mode):
+                yield os.path.relpath(path, root), st
+
+
+def create_snapshot(job, name, root, keep=BACKUP_KEEP):
+    """
+    Back up a server directory as a new snapshot.
+
+    Files whose size and mtime match the previous snapshot reuse its chunk
+    list without being read. Other files are chunked, hashed and compressed
+    on a thread pool, storing only chunks missing from the store.
+    """
+    previous = {}
+    pins = pinned[job.id] = set()
+    try:
+        with gc_lock:
+            snapshots = list_snapshots(name)
+            if snapshots:
+                last = load_snapshot(name, snapshots[0]['id'])
+                previous = {f['path']: f for f in last['files']}
+                for entry in last['files']:
+                    pins.update(entry['chunks'])
+        snapshot = _create_snapshot(job, name, root, previous, pins)
+    finally:
+        del pinned[job.id]
+    if keep:
+        job.update(message='Removing old snapshots')
+        prune_snapshots(name, keep)
+    return snapshot
+
+
+def _create_snapshot(job, name, root, previous, pins):
+
+    files = list(walk_files(root))
+    total = sum(st.st_size for _, st in files)
+    job.update(progress=0, total=total, message='Backing up files')
+    stats = {'file_count': len(files), 'size': total, 'new_chunks': 0, 'stored_bytes': 0, 'reused_files': 0}
+    lock = threading.Lock()
+    done = [0]
+    entries = {}
+
+    def backup(rel, st):
+        job.check_cancelled()
+        old = previous.get(rel)
+        if old is not None and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+            chunks = old['chunks']
+            with lock:
+                stats['reused_files'] += 1
+        else:
+            chunks = store_file(os.path.join(root, rel), lock, stats, pins)
+        entries[rel] = {'path': rel, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'mode': st.st_mode & 0o7777, 'chunks': chunks}
+        with lock:
+            done[0] += st.st_size
+            job.update(progress=done[0])
+
+    with ThreadPoolExecutor(max_workers=BACKUP_WORKERS) as pool:
+        for future in [pool.submit(backup, rel, st) for rel, st in files]:
+            future.result()
+
+    snapshot_id = time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6]
+    snapshot = {
+        'id': snapshot_id,
+        'name': name,
+        'created_at': time.time(),
+        **stats,
+        'files': [entries[rel] for rel, _ in files],
+    }
+    os.makedirs(snapshot_dir(name), exist_ok=True)
+    tmp = f'{snapshot_dir(name)}/{snapshot_id}.json.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, f'{snapshot_dir(name)}/{snapshot_id}.json')
+    return {k: v for k, v in snapshot.items() if k != 'files'}
+
+
+def restore_snapshot(job, name, snapshot_id, root):
+    """
+    Restore a server directory to a snapshot. Files changed since the
+    snapshot are rewritten, files added since are removed.
+    """
+    with gc_lock:
+        snapshot = load_snapshot(name, snapshot_id)
+        if snapshot is None:
+            raise ValueError('Snapshot not found.')
+        pinned[job.id] = {digest for entry in snapshot['files'] for digest in entry['chunks']}
+    try:
+        return _restore_snapshot(job, snapshot, root)
+    finally:
+        del pinned[job.id]
+
+
+def _restore_snapshot(job, snapshot, root):
+    wanted = {f['path']: f for f in snapshot['files']}
+    job.update(progress=0, total=snapshot['size'], message='Restoring files')
+
+    current = dict(walk_files(root)) if os.path.isdir(root) else {}
+    lock = threading.Lock()
+    done = [0]
+
+    def restore(entry):
+        job.check_cancelled()
+        path = os.path.join(root, entry['path'])
+        st = current.get(entry['path'])
+        if st is None or st.st_size != entry['size'] or st.st_mtime_ns != entry['mtime_ns']:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp, 'wb') as out:
+                for digest in entry['chunks']:
+                    with open(chunk_path(digest), 'rb') as f:
+                        out.write(zlib.decompress(f.read()))
+            os.chmod(tmp, entry['mode'])
+            os.replace(tmp, path)
+            os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+        with lock:
+            done[0] += entry['size']
+            job.update(progress=done[0])
+
+    with ThreadPoolExecutor(max_workers=BACKUP_WORKERS) as pool:
+        for future in [pool.submit(restore, entry) for entry in wanted.values()]:
+            future.result()
+
+    removed = 0
+    for rel in current:
+        if rel not in wanted:
+            os.remove(os.path.join(root, rel))
+            removed += 1
+    return {'id': snapshot['id'], 'files': len(wanted), 'removed': removed}
+
+
+def delete_snapshot(name, snapshot_id):
+    path = f'{snapshot_dir(name)}/{os.path.basename(snapshot_id)}.json'
+    if not os.path.exists(path):
+        return False
+    os.remove(path)
+    return True
+
+
+def prune_snapshots(name, keep=BACKUP_KEEP):
+    """
+    Delete all but the newest `keep` snapshots of a server, then collect
+    the chunks no snapshot refers to any more.
+    """
+    for snapshot in list_snapshots(name)[keep:]:
+        delete_snapshot(name, snapshot['id'])
+    return collect_garbage()
+
+
+def collect_garbage():
+    """
+    Remove stored chunks not referenced by any snapshot of any server.
+    """
+    with gc_lock:
+        referenced = set().union(*pinned.values())
+        root = f'{backup_dir()}/snapshots'
+        if os.path.isdir(root):
+            for server in os.listdir(root):
+                for snapshot in list_snapshots(server):
+                    for entry in load_snapshot(server, snapshot['id'])['files']:
+                        referenced.update(entry['chunks'])
+        removed = freed = 0
+        chunks = f'{backup_dir()}/chunks'
+        if os.path.isdir(chunks):
+            for folder in os.scandir(chunks):
+                for chunk in os.scandir(folder.path):
+                    # Temporary files are chunks still being written
+                    if chunk.name in referenced or chunk.name.endswith('.tmp'):
+                        continue
+                    freed += chunk.stat().st_size
+                    os.remove(chunk.path)
+                    removed += 1
+        return {'removed_chunks': removed, 'freed_bytes': freed}
+
+
+
+@asynccontextmanager
+async def saving_paused(name, pid):
+    """
+    Turn off autosave and flush the world of a running managed server for
+    the duration of the block, so region files do not change while read.
+    """
+    managed = get_process(name, pid)
+    if managed is None or not managed.running:
+        yield
+        return
+    since = await managed.send('save-off', 'save-all')
+    _, saved = await managed.collect(since, SAVE_TIMEOUT, SAVED_PATTERN)
+    if not saved:
+        logger.warning('Server did not confirm save-all, backing up anyway', extra={'server': name})
+    try:
+        yield
+    finally:
+        try:
+            if managed.running:
+                await managed.send('save-on')
+        except (RuntimeError, ConnectionError) as e:
+            logger.error('Error turning autosave back on: %s', e, extra={'server': name})
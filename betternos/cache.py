@@ -0,0 +1,198 @@
+import time
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.sqlite import insert
+from betternos.models import Server, RegistryVersion
+from betternos.db import writer
+
+CACHE_TTL = 2  # seconds before re-checking the registry version in the database
+
+
+class CachedServer:
+    """
+    In-memory copy of a Server row.
+    """
+    __slots__ = ('id', 'name', 'ip', 'pid', 'secret', 'run_cmd', 'cpu_affinity', 'nice', 'restart_policy', 'exit_code', 'exit_signal')
+
+    def __init__(self, id, name, ip, pid, secret, run_cmd, cpu_affinity=None, nice=None, restart_policy=None, exit_code=None, exit_signal=None):
+        self.id = id
+        self.name = name
+        self.ip = ip
+        self.pid = pid
+        self.secret = secret
+        self.run_cmd = run_cmd
+        self.cpu_affinity = cpu_affinity
+        self.nice = nice
+        self.restart_policy = restart_policy
+        self.exit_code = exit_code
+        self.exit_signal = exit_signal
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            row.id, row.name, row.ip, row.pid, row.secret, row.run_cmd,
+            row.cpu_affinity, row.nice, row.restart_policy, row.exit_code, row.exit_signal,
+        )
+
+
+async def get_registry_version(db):
+    result = await db.execute(select(RegistryVersion.version).where(RegistryVersion.id == 1))
+    return result.scalar_one_or_none() or 0
+
+
+async def bump_registry_version(db):
+    """
+    Mark the servers table as changed for the caches of other workers.
+    Runs inside the caller's transaction; the caller commits.
+    """
+    stmt = insert(RegistryVersion).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={'version': RegistryVersion.version + 1})
+    await db.execute(stmt)
+    return await get_registry_version(db)
+
+
+class ServerCache:
+    """
+    Process-wide cache of Server records, keyed by name.
+
+    Writes made through this API update the cache directly. Writes made by
+    other workers or processes bump the registry version, which every cache
+    checks at most once per TTL and reloads from when it has changed.
+    """
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.servers = {}
+        self.version = None
+        self.checked_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    async def load(self, db):
+        version = await get_registry_version(db)
+        result = await db.execute(select(Server))
+        self.servers = {row.name: CachedServer.from_row(row) for row in result.scalars().all()}
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.reloads += 1
+
+    async def _revalidate(self, db):
+        if time.monotonic() - self.checked_at < self.ttl:
+            return
+        version = await get_registry_version(db)
+        if version != self.version:
+            await self.load(db)
+        else:
+            self.checked_at = time.monotonic()
+
+    async def get(self, db, name):
+        """
+        Get a server by name, or None if it does not exist.
+        """
+        await self._revalidate(db)
+        server = self.servers.get(name)
+        if server is not None:
+            self.hits += 1
+            return server
+        self.misses += 1
+        result = await db.execute(select(Server).where(Server.name == name))
+        row = result.scalar_one_or_none()
+        if row is None:
+            return None
+        server = CachedServer.from_row(row)
+        self.servers[name] = server
+        return server
+
+    async def get_many(self, db, names):
+        """
+        Get several servers by name, fetching all cache misses in one query.
+        Returns a dict of the servers that exist.
+        """
+        await self._revalidate(db)
+        found = {}
+        missing = []
+        for name in names:
+            server = self.servers.get(name)
+            if server is not None:
+                found[name] = server
+            else:
+                missing.append(name)
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            result = await db.execute(select(Server).where(Server.name.in_(missing)))
+            for row in result.scalars().all():
+                found[row.name] = self.servers[row.name] = CachedServer.from_row(row)
+        return found
+
+    def _written(self, old_version, new_version):
+        # Our own write: move along with it instead of reloading everything
+        if self.version == old_version:
+            self.version = new_version
+
+    async def _add_row(self, db, server):
+        old_version = await get_registry_version(db)
+        db.add(server)
+        await db.flush()
+        return old_version, await bump_registry_version(db)
+
+    async def _save_row(self, db, values):
+        values = dict(values)
+        name = values.pop('name')
+        old_version = await get_registry_version(db)
+        await db.execute(update(Server).where(Server.name == name).values(**values))
+        return old_version, await bump_registry_version(db)
+
+    async def _remove_row(self, db, name):
+        old_version = await get_registry_version(db)
+        await db.execute(delete(Server).where(Server.name == name))
+        return old_version, await bump_registry_version(db)
+
+    async def add(self, server):
+        """
+        Insert a new Server row and cache it.
+        """
+        old_version, new_version = await writer.write(self._add_row, values=server)
+        self.servers[server.name] = CachedServer.from_row(server)
+        self._written(old_version, new_version)
+        return self.servers[server.name]
+
+    async def save(self, name, **values):
+        """
+        Update columns of a server in the database and in the cache.
+        Saves of the same server queued together are written once.
+        """
+        old_version, new_version = await writer.write(self._save_row, ('server', name), {'name': name, **values})
+        self.set(name, **values)
+        self._written(old_version, new_version)
+
+    async def remove(self, name):
+        """
+        Delete a server from the database and the cache.
+        """
+        old_version, new_version = await writer.write(self._remove_row, ('server', name), name)
+        self.servers.pop(name, None)
+        self._written(old_version, new_version)
+
+    def set(self, name, **values):
+        """
+        Update a cached server after the database has been written elsewhere.
+        """
+        server = self.servers.get(name)
+        if server is not None:
+            for key, value in values.items():
+                setattr(server, key, value)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.servers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+            "reloads": self.reloads,
+            "version": self.version,
+        }
+
+
+server_cache = ServerCache()
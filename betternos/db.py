@@ -1,8 +1,162 @@
+import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy import event, inspect, text
 from sqlalchemy.orm import declarative_base
 
 DATABASE_URL = "sqlite+aiosqlite:///./betternos.db"
+DB_POOL_SIZE = 5  # connections kept open; with WAL, readers do not wait for the writer
+DB_MAX_OVERFLOW = 10  # extra connections opened under load
+DB_BUSY_TIMEOUT = 5000  # ms a connection waits for a lock held by another process
+DB_SYNCHRONOUS = 'NORMAL'  # with WAL, commits are only fsynced at checkpoints
+WRITE_BATCH_DELAY = 0.005  # seconds the writer waits for more writes to join a batch
 
-engine = create_async_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_async_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT / 1000},
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+)
 SessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA synchronous={DB_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT}')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+
+def add_missing_columns(conn):
+    """
+    Add columns that were added to the models after their table was created.
+    Only nullable columns without server defaults can be added this way.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                col_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+
+class DatabaseWriter:
+    """
+    The single coroutine all database writes of a process go through.
+
+    Writes queued while a transaction is being committed are committed
+    together in the next one, so a burst of small updates costs one commit.
+    Writes with the same key and apply are coalesced: their values are
+    merged and applied once. If a batch fails, its writes are retried one by one so
+    only the failing write reports the error.
+    """
+
+    def __init__(self, batch_delay=WRITE_BATCH_DELAY):
+        self.batch_delay = batch_delay
+        self.pending = {}  # key -> [apply, values, futures]
+        self.wakeup = None
+        self.closing = False
+        self.task = None
+        self.writes = 0
+        self.coalesced = 0
+        self.batches = 0
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.closing = False
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Commit everything still queued, then stop the writer.
+        """
+        if self.task is None:
+            return
+        self.closing = True
+        self.wakeup.set()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    async def write(self, apply, key=None, values=None):
+        """
+        Run `await apply(db, values)` in the next batched transaction and
+        return its result once committed. Writes sharing a key, such as
+        updates of one server row, are merged when their apply is the same:
+        later values win and apply runs once. Without a running writer the
+        write is committed directly.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if key is None:
+            key = object()
+        if self.task is None:
+            await self._commit({key: [apply, values, [future]]})
+            return await future
+        self.writes += 1
+        queued = self.pending.get(key)
+        if queued is not None and queued[0] != apply:
+            # A different operation on the same key, such as a delete after
+            # an update: both run, in order, and later writes merge with this one
+            self.pending = {(object() if k == key else k): v for k, v in self.pending.items()}
+            queued = None
+        if queued is not None:
+            self.coalesced += 1
+            if isinstance(values, dict) and isinstance(queued[1], dict):
+                queued[1].update(values)
+            else:
+                queued[1] = values
+            queued[2].append(future)
+        else:
+            self.pending[key] = [apply, values, [future]]
+        self.wakeup.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if self.batch_delay and not self.closing:
+                await asyncio.sleep(self.batch_delay)
+            batch, self.pending = self.pending, {}
+            if batch:
+                await self._commit(batch)
+            if self.closing and not self.pending:
+                return
+
+    async def _commit(self, batch):
+        results = []
+        try:
+            async with SessionLocal() as db:
+                for apply, values, _ in batch.values():
+                    results.append(await apply(db, values))
+                await db.commit()
+        except Exception as e:
+            if len(batch) > 1:
+                for key, queued in batch.items():
+                    await self._commit({key: queued})
+                return
+            for future in next(iter(batch.values()))[2]:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        for (_, _, futures), result in zip(batch.values(), results):
+            for future in futures:
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "queued": len(self.pending),
+        }
+
+
+writer = DatabaseWriter()
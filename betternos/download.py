@@ -0,0 +1,73 @@
+import logging
+import os
+import hashlib
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from betternos.extract import extract_archive
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # bytes written at a time
+DOWNLOAD_TIMEOUT = (10, 60)  # connect and read timeouts in seconds
+DOWNLOAD_POOL_SIZE = 16  # keep-alive connections kept per host
+
+# Shared session so downloads reuse pooled keep-alive connections
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE))
+session.mount('https://', HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE))
+
+
+def response_filename(response, url):
+    """
+    Get the name of a downloaded file from the response, or from the URL.
+    """
+    # Try to get filename from Content-Disposition header
+    cd = response.headers.get('Content-Disposition')
+    if cd and 'filename=' in cd:
+        filename = cd.split('filename=')[1].split(';')[0].strip('\" ')
+    else:
+        # Fallback: use the last part of the URL path
+        filename = os.path.basename(urlparse(url).path) or 'downloaded_file'
+    return os.path.basename(filename) or 'downloaded_file'
+
+
+def download_file(job, url, path, sha256=None, extract=False):
+    """
+    Stream a URL to disk with bounded memory, reporting progress on the job.
+
+    The body is written to a .part file that is renamed once complete and,
+    if given, the SHA-256 matches. With extract the archive is unpacked
+    from disk and removed. Returns the file name.
+    """
+    with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        filename = response_filename(response, url)
+        length = response.headers.get('Content-Length')
+        job.update(progress=0, total=int(length) if length else None, message=f'Downloading {filename}')
+
+        target = f'{path}/{filename}'
+        part = f'{target}.part'
+        hasher = hashlib.sha256()
+        received = 0
+        try:
+            with open(part, 'wb') as file:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    job.check_cancelled()
+                    file.write(chunk)
+                    hasher.update(chunk)
+                    received += len(chunk)
+                    job.update(progress=received)
+            if sha256 is not None and hasher.hexdigest() != sha256.lower():
+                raise ValueError('Checksum mismatch.')
+            os.replace(part, target)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+
+    logger.info('Downloaded file as %s', filename)
+    if extract:
+        job.update(message=f'Extracting {filename}')
+        extract_archive(job, target, path)
+        os.remove(target)
+    return filename
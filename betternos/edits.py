@@ -0,0 +1,149 @@
+import os
+import re
+import asyncio
+import hashlib
+import tempfile
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+# One lock per file path so edits through this API never interleave
+locks = {}
+
+
+class EditConflict(Exception):
+    """
+    The file changed since the client last read it.
+    """
+
+    def __init__(self, current):
+        super().__init__('File has been modified since it was read.')
+        self.current = current
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def apply_ranges(data, ranges):
+    """
+    Replace byte ranges of data. Each range is a (start, end, content) tuple
+    referring to offsets in the original data; ranges may not overlap.
+    """
+    ranges = sorted(ranges, key=lambda r: r[0])
+    out = []
+    pos = 0
+    for start, end, content in ranges:
+        if start < pos or end < start or end > len(data):
+            raise ValueError(f'Invalid or overlapping range {start}-{end}.')
+        out.append(data[pos:start])
+        out.append(content)
+        pos = end
+    out.append(data[pos:])
+    return b''.join(out)
+
+
+def apply_patch(text, patch):
+    """
+    Apply a unified diff to text. The context and removed lines of every
+    hunk must match the text exactly.
+    """
+    lines = text.splitlines(keepends=True)
+    patch_lines = patch.splitlines(keepends=True)
+    out = []
+    pos = 0  # index into lines
+    i = 0
+    while i < len(patch_lines):
+        match = HUNK_HEADER.match(patch_lines[i])
+        i += 1
+        if match is None:
+            # File headers (---/+++) and anything before the first hunk
+            continue
+        start = int(match.group(1))
+        # A hunk removing no lines inserts after its start line
+        if match.group(2) != '0':
+            start -= 1
+        if start < pos:
+            raise ValueError('Hunks overlap or are out of order.')
+        out.extend(lines[pos:start])
+        pos = start
+        op = None
+        while i < len(patch_lines) and not patch_lines[i].startswith('@@'):
+            line = patch_lines[i]
+            i += 1
+            if line.startswith('\\'):
+                # "\ No newline at end of file" after an added line
+                if op == '+' and out[-1].endswith('\n'):
+                    out[-1] = out[-1][:-1]
+                continue
+            op, body = line[:1], line[1:]
+            if op == '+':
+                out.append(body)
+            elif op in (' ', '-'):
+                if pos >= len(lines) or lines[pos].rstrip('\r\n') != body.rstrip('\r\n'):
+                    raise ValueError(f'Patch does not apply at line {pos + 1}.')
+                if op == ' ':
+                    out.append(lines[pos])
+                pos += 1
+            elif line.strip() == '':
+                # Blank context line with its leading space stripped
+                if pos >= len(lines) or lines[pos].strip() != '':
+                    raise ValueError(f'Patch does not apply at line {pos + 1}.')
+                out.append(lines[pos])
+                pos += 1
+            else:
+                raise ValueError(f'Invalid patch line: {line!r}')
+    out.extend(lines[pos:])
+    return ''.join(out)
+
+
+def write_atomic(path, data):
+    """
+    Replace a file so readers see either the old or the new content, never a
+    partial write: write a temporary file next to it, fsync, then rename.
+    """
+    folder = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    dir_fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _edit(path, if_match, content, ranges, patch):
+    with open(path, 'rb') as f:
+        data = f.read()
+    current = content_hash(data)
+    if if_match is not None and if_match.strip('"') != current:
+        raise EditConflict(current)
+    if patch is not None:
+        data = apply_patch(data.decode('utf-8'), patch).encode('utf-8')
+    elif ranges is not None:
+        data = apply_ranges(data, ranges)
+    else:
+        data = content.encode('utf-8')
+    write_atomic(path, data)
+    return content_hash(data)
+
+
+async def edit_file(path, if_match=None, content=None, ranges=None, patch=None):
+    """
+    Atomically change a file by full replacement, byte ranges or a unified
+    diff, optionally only if its current SHA-256 equals if_match.
+    Returns the hash of the new content.
+    """
+    lock = locks.setdefault(path, asyncio.Lock())
+    async with lock:
+        return await asyncio.to_thread(_edit, path, if_match, content, ranges, patch)
@@ -0,0 +1,131 @@
+import os
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+EXTRACT_CHUNK_SIZE = 1024 * 1024  # bytes decompressed at a time
+EXTRACT_WORKERS = min(8, os.cpu_count() or 1)  # threads decompressing in parallel
+EXTRACT_MAX_SIZE = 20 * 1024 ** 3  # max total uncompressed size of an archive
+EXTRACT_MAX_ENTRIES = 100_000  # max number of entries in an archive
+EXTRACT_MAX_RATIO = 1000  # max compression ratio of a single entry
+
+
+def member_path(dest, name):
+    """
+    Resolve where an archive entry would be written, refusing paths outside dest.
+    """
+    target = os.path.realpath(os.path.join(dest, name))
+    if target != dest and not target.startswith(dest + os.sep):
+        raise ValueError(f'Unsafe path in archive: {name}')
+    return target
+
+
+def scan_archive(zip_ref, dest, max_size=EXTRACT_MAX_SIZE, max_entries=EXTRACT_MAX_ENTRIES):
+    """
+    Check an archive's central directory before extracting anything.
+    Returns the (info, target path) pairs to extract and the total size.
+    """
+    infos = zip_ref.infolist()
+    if len(infos) > max_entries:
+        raise ValueError(f'Archive has {len(infos)} entries, the limit is {max_entries}.')
+    members = []
+    total = 0
+    for info in infos:
+        target = member_path(dest, info.filename)
+        if info.compress_size and info.file_size > EXTRACT_CHUNK_SIZE and info.file_size / info.compress_size > EXTRACT_MAX_RATIO:
+            raise ValueError(f'Suspicious compression ratio for {info.filename}.')
+        total += info.file_size
+        members.append((info, target))
+    if total > max_size:
+        raise ValueError(f'Archive expands to {total} bytes, the limit is {max_size}.')
+    return members, total
+
+
+def extract_archive(job, archive, path, workers=EXTRACT_WORKERS, max_size=EXTRACT_MAX_SIZE, max_entries=EXTRACT_MAX_ENTRIES):
+    """
+    Extract a zip archive, given as a path or a seekable file object, into path.
+
+    The archive is read in place. Entries of an archive on disk are decompressed
+    by a pool of threads, each with its own handle on the file; a file object
+    is extracted by a single thread. Progress is reported on the job in bytes.
+    """
+    dest = os.path.realpath(path)
+    with zipfile.ZipFile(archive, 'r') as zip_ref:
+        members, total = scan_archive(zip_ref, dest, max_size, max_entries)
+        job.update(progress=0, total=total)
+
+        # Create all directories up front so workers never race on them
+        for info, target in members:
+            os.makedirs(target if info.is_dir() else os.path.dirname(target), exist_ok=True)
+        files = [(info, target) for info, target in members if not info.is_dir()]
+        # Biggest entries first so one large file does not finish last
+        files.sort(key=lambda m: m[0].file_size, reverse=True)
+
+        lock = threading.Lock()
+        done = [0]
+        failed = threading.Event()
+        local = threading.local()
+        handles = []
+
+        def handle():
+            if not isinstance(archive, (str, os.PathLike)):
+                return zip_ref
+            if not hasattr(local, 'zip_ref'):
+                local.zip_ref = zipfile.ZipFile(archive, 'r')
+                with lock:
+                    handles.append(local.zip_ref)
+            return local.zip_ref
+
+        def extract(info, target):
+            # ZipExtFile stops at the declared size and checks the CRC,
+            # so an entry cannot write more than the pre-scan allowed
+            with handle().open(info) as src, open(target, 'wb') as dst:
+                while chunk := src.read(EXTRACT_CHUNK_SIZE):
+                    if failed.is_set():
+                        return
+                    job.check_cancelled()
+                    dst.write(chunk)
+                    with lock:
+                        done[0] += len(chunk)
+                        job.update(progress=done[0])
+
+        if not isinstance(archive, (str, os.PathLike)):
+            workers = 1
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(extract, info, target) for info, target in files]
+                finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in finished:
+                    if future.exception() is not None:
+                        failed.set()
+                        for f in futures:
+                            f.cancel()
+                        raise future.exception()
+        finally:
+            for h in handles:
+                h.close()
+    return {"entries": len(members), "size": total}
+
+
+def extract_upload(job, upload, path):
+    """
+    Extract an archive from an open file, such as a duplicate of an upload's
+    temporary file, then close it.
+
+    Temporary files have no name, so where /proc exists the file is reopened
+    through it and extracted by the worker pool like an archive on disk.
+    """
+    with upload:
+        proc_path = f'/proc/self/fd/{upload.fileno()}'
+        if os.path.exists(proc_path):
+            return extract_archive(job, proc_path, path)
+        return extract_archive(job, upload, path)
+
+
+def extract_and_remove(job, archive, path):
+    """
+    Extract an archive on disk, then delete it.
+    """
+    result = extract_archive(job, archive, path)
+    os.remove(archive)
+    return result
@@ -0,0 +1,298 @@
+import os
+import time
+import asyncio
+import logging
+import httpx
+from starlette.routing import Match
+from betternos.db import SessionLocal
+from betternos.cache import server_cache
+
+logger = logging.getLogger(__name__)
+
+# host:port of the BetterNos instances this one coordinates; servers whose ip is one of them live there
+AGENTS = [a.strip() for a in os.environ.get('BETTERNOS_AGENTS', '').split(',') if a.strip()]
+AGENT_TOKEN = os.environ.get('BETTERNOS_AGENT_TOKEN')  # shared by coordinator and agents; needed by the fleet-wide views
+AGENT_TIMEOUT = 3  # seconds an agent gets to answer a fleet-wide query
+AGENT_POLL_INTERVAL = 10  # seconds between health checks of each agent
+AGENT_RETRY_AFTER = 5  # seconds a down agent is failed fast before it is tried again
+AGENT_CONNECTIONS = 20  # open connections kept per agent
+AGENT_KEEPALIVE = 60  # seconds an idle connection is kept
+PROXY_TIMEOUT = 300  # seconds a proxied call may wait for the agent between reads
+
+# Per-server routes handled here even for remote servers
+LOCAL_ACTIONS = {'delete-server'}
+# Headers that belong to one connection and are not forwarded
+HOP_HEADERS = {b'host', b'connection', b'keep-alive', b'transfer-encoding', b'te', b'trailer', b'upgrade', b'proxy-connection'}
+
+
+class AgentUnavailable(Exception):
+    pass
+
+
+def valid_agent_token(token):
+    """
+    Whether a request may see the fleet-wide views. They are closed when
+    BETTERNOS_AGENT_TOKEN is not set.
+    """
+    return AGENT_TOKEN is not None and token == AGENT_TOKEN
+
+
+class Agent:
+    """
+    Another BetterNos instance, and what was last seen of it.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.url = address if '://' in address else f'http://{address}'
+        self.healthy = None  # unknown until the first check
+        self.error = None
+        self.latency = None
+        self.checked_at = 0
+        self.seen_at = None
+        self.state = {}  # the last /agent-status reply
+
+    def mark(self, healthy, error=None, latency=None):
+        self.healthy = healthy
+        self.error = error
+        self.checked_at = time.time()
+        if healthy:
+            self.seen_at = self.checked_at
+            self.latency = latency
+
+    @property
+    def failing_fast(self):
+        return self.healthy is False and time.time() - self.checked_at < AGENT_RETRY_AFTER
+
+    def to_dict(self):
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "error": self.error,
+            "latency": self.latency,
+            "checked_at": self.checked_at or None,
+            "seen_at": self.seen_at,
+            **self.state,
+        }
+
+
+class Federation:
+    """
+    Routes calls for servers that live on other BetterNos instances.
+
+    Each agent is reached over a shared pool of keep-alive connections.
+    Agents are health-checked in the background and the replies cached, so
+    fleet views are served without waiting on slow hosts; an agent that just
+    failed is failed fast instead of being waited on by every request.
+    """
+
+    def __init__(self, agents=AGENTS, timeout=AGENT_TIMEOUT, poll_interval=AGENT_POLL_INTERVAL):
+        self.agents = {address: Agent(address) for address in agents}
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.client = None
+        self.task = None
+
+    def start(self):
+        if not self.agents:
+            return
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout),
+            headers={'agent-token': AGENT_TOKEN or ''},
+            limits=httpx.Limits(
+                max_connections=AGENT_CONNECTIONS * len(self.agents),
+                max_keepalive_connections=AGENT_CONNECTIONS * len(self.agents),
+                keepalive_expiry=AGENT_KEEPALIVE,
+            ),
+        )
+        self.task = asyncio.create_task(self._poller())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def agent_for(self, ip):
+        """
+        The agent a server with this ip lives on, or None when it is local.
+        """
+        return self.agents.get(ip)
+
+    async def call(self, agent, method, path, force=False, **kwargs):
+        """
+        Make a request to an agent and return its JSON reply, whatever the
+        status. Raises AgentUnavailable when the agent cannot be reached in
+        time or does not answer with JSON. With `force` the request goes out
+        even to an agent failing fast.
+        """
+        if agent.failing_fast and not force:
+            raise AgentUnavailable(agent.error)
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, f'{agent.url}{path}', **kwargs)
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            agent.mark(False, str(e) or type(e).__name__)
+            raise AgentUnavailable(agent.error) from e
+        agent.mark(True, latency=time.perf_counter() - start)
+        return data
+
+    async def fan_out(self, calls, timeout=None, force=False):
+        """
+        Run one call per agent concurrently. `calls` maps agents to the
+        arguments of call(); returns their replies by agent, with an error
+        reply for each agent that failed or did not answer within `timeout`.
+        """
+        timeout = timeout or self.timeout
+
+        async def one(agent, args):
+            try:
+                return await asyncio.wait_for(self.call(agent, *args[:2], force=force, **args[2], timeout=timeout), timeout)
+            except asyncio.TimeoutError:
+                agent.mark(False, 'Timed out')
+            except AgentUnavailable:
+                pass
+            return {"message": "Agent unavailable.", "error": agent.error, "success": False}
+
+        agents = list(calls)
+        results = await asyncio.gather(*[one(agent, calls[agent]) for agent in agents])
+        return dict(zip(agents, results))
+
+    async def refresh(self):
+        """
+        Check every agent now and cache what it reports.
+        """
+        # A health check always goes out, even to an agent failing fast;
+        # other requests keep failing fast on it until it has answered
+        results = await self.fan_out({agent: ('GET', '/agent-status', {}) for agent in self.agents.values()}, force=True)
+        for agent, data in results.items():
+            if data.get('success'):
+                agent.state = {"servers": data.get('servers', []), "scheduler": data.get('scheduler')}
+            elif agent.healthy:
+                agent.error = data.get('message')
+
+    async def _poller(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception('Error checking agents')
+            await asyncio.sleep(self.poll_interval)
+
+    def group(self, auths, entries):
+        """
+        Split the ServerAuth of a bulk request into local ones and those of
+        each agent, by the ip of the servers in `entries`.
+        """
+        local = []
+        remote = {}
+        for auth in auths:
+            entry = entries.get(auth.name)
+            agent = self.agent_for(entry.ip) if entry is not None else None
+            if agent is None:
+                local.append(auth)
+            else:
+                remote.setdefault(agent, []).append(auth)
+        return local, remote
+
+    def status(self):
+        return [agent.to_dict() for agent in self.agents.values()]
+
+    async def proxy(self, agent, scope, receive, send, timeout=PROXY_TIMEOUT):
+        """
+        Forward an HTTP request to an agent as is, streaming both bodies.
+        """
+        if agent.failing_fast:
+            raise AgentUnavailable(agent.error)
+
+        async def body():
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                yield message.get('body', b'')
+                if not message.get('more_body', False):
+                    return
+
+        path = scope.get('raw_path', b'').decode('latin-1') or scope['path']
+        url = f'{agent.url}{path}'
+        if scope.get('query_string'):
+            url += '?' + scope['query_string'].decode('latin-1')
+        headers = [(k, v) for k, v in scope['headers'] if k not in HOP_HEADERS]
+        has_body = any(k in (b'content-length', b'content-type') for k, _ in headers)
+        request = self.client.build_request(
+            scope['method'], url, headers=headers, content=body() if has_body else None,
+            timeout=httpx.Timeout(self.timeout, read=timeout),
+        )
+        start = time.perf_counter()
+        try:
+            response = await self.client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            agent.mark(False, str(e) or type(e).__name__)
+            raise AgentUnavailable(agent.error) from e
+        agent.mark(True, latency=time.perf_counter() - start)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': [(k, v) for k, v in response.headers.raw if k.lower() not in HOP_HEADERS],
+            })
+            async for chunk in response.aiter_raw():
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await response.aclose()
+
+
+class FederationMiddleware:
+    """
+    ASGI middleware sending the per-server routes of remote servers to the
+    agent they live on. The matched route is recorded in the scope as the
+    router would, so instrumentation labels proxied requests the same way.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not federation.agents:
+            await self.app(scope, receive, send)
+            return
+        route, params = match_route(scope)
+        agent = None
+        if route is not None and route.path.startswith('/{name}/') and route.path.split('/')[2] not in LOCAL_ACTIONS:
+            async with SessionLocal() as db:
+                entry = await server_cache.get(db, params['name'])
+            if entry is not None:
+                agent = federation.agent_for(entry.ip)
+        if agent is None:
+            await self.app(scope, receive, send)
+            return
+        scope['route'] = route
+        scope['path_params'] = params
+        timeout = None if route.path == '/{name}/stream-logs' else PROXY_TIMEOUT
+        try:
+            await federation.proxy(agent, scope, receive, send, timeout)
+        except AgentUnavailable as e:
+            logger.warning('Agent %s unavailable: %s', agent.address, e, extra={'server': params['name']})
+            body = b'{"message":"Agent unavailable.","success":false}'
+            await send({'type': 'http.response.start', 'status': 502, 'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+            await send({'type': 'http.response.body', 'body': body})
+
+
+def match_route(scope):
+    """
+    The route of the application a request would be handled by, and its path parameters.
+    """
+    for route in scope['app'].router.routes:
+        match, child = route.matches(scope)
+        if match == Match.FULL:
+            return route, child.get('path_params', {})
+    return None, {}
+
+
+federation = Federation()
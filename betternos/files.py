@@ -0,0 +1,154 @@
+import os
+import json
+import base64
+import fnmatch
+import codecs
+import heapq
+from email.utils import formatdate, parsedate_to_datetime
+
+LIST_DEFAULT_LIMIT = 500  # entries per page
+LIST_MAX_LIMIT = 5000
+PREVIEW_MAX_BYTES = 1024 * 1024  # largest text preview returned by get-files
+SORT_KEYS = {
+    'name': lambda e: e['path'],
+    'size': lambda e: e['size'],
+    'mtime': lambda e: e['mtime'],
+}
+
+
+def scan_dir(path, depth=0, pattern=None, prefix=''):
+    """
+    Yield the entries of a directory with their type, size and mtime, from a
+    single os.scandir pass, descending up to `depth` levels into subfolders.
+    """
+    try:
+        it = os.scandir(path)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+    with it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            rel = prefix + entry.name
+            if pattern is None or fnmatch.fnmatch(entry.name, pattern):
+                yield {
+                    "name": entry.name,
+                    "path": rel,
+                    "type": "folder" if is_dir else "file",
+                    "size": 0 if is_dir else st.st_size,
+                    "mtime": st.st_mtime,
+                }
+            if is_dir and depth > 0:
+                yield from scan_dir(entry.path, depth - 1, pattern, rel + '/')
+
+
+def encode_cursor(key, path):
+    return base64.urlsafe_b64encode(json.dumps([key, path]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        key, path = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return key, path
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor.')
+
+
+def list_dir(path, depth=0, pattern=None, sort='name', reverse=False, cursor=None, limit=LIST_DEFAULT_LIMIT):
+    """
+    Get one page of a directory listing, sorted by name, size or mtime.
+
+    Pages are chained with an opaque cursor holding the sort key of the last
+    entry returned, so concurrent changes to the folder never shift a page.
+    Only the requested page is kept sorted in memory.
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f'Cannot sort by {sort}.')
+    limit = max(1, min(limit, LIST_MAX_LIMIT))
+    get_key = SORT_KEYS[sort]
+
+    def key(e):
+        return (get_key(e), e['path'])
+
+    entries = scan_dir(path, depth, pattern)
+    if cursor is not None:
+        after = tuple(decode_cursor(cursor))
+        if reverse:
+            entries = (e for e in entries if key(e) < after)
+        else:
+            entries = (e for e in entries if key(e) > after)
+    pick = heapq.nlargest if reverse else heapq.nsmallest
+    page = pick(limit + 1, entries, key=key)
+    more = len(page) > limit
+    page = page[:limit]
+    next_cursor = encode_cursor(*key(page[-1])) if more else None
+    return page, next_cursor
+
+
+def read_preview(path, max_bytes=PREVIEW_MAX_BYTES):
+    """
+    Read at most max_bytes of a text file.
+    Returns the text and whether it was truncated; raises UnicodeDecodeError for binary files.
+    """
+    with open(path, 'rb') as f:
+        data = f.read(max_bytes + 1)
+    truncated = len(data) > max_bytes
+    # A truncated preview may end in the middle of a character
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    text = decoder.decode(data[:max_bytes], final=not truncated)
+    return text, truncated
+
+
+def file_etag(st):
+    """
+    Validator for a file, changing whenever it is replaced or modified.
+    """
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def not_modified(st, if_none_match=None, if_modified_since=None):
+    """
+    Evaluate the conditional GET headers of a request against a file.
+    """
+    if if_none_match is not None:
+        etag = file_etag(st)
+        return any(tag.strip() in (etag, '*') for tag in if_none_match.split(','))
+    if if_modified_since is not None:
+        try:
+            return int(st.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def last_modified(st):
+    return formatdate(st.st_mtime, usegmt=True)
+
+
+def remove_path(job, path):
+    """
+    Delete a file or a whole folder, deepest entries first, reporting the
+    number of entries removed on the job so large trees can be cancelled.
+    """
+    if not os.path.isdir(path) or os.path.islink(path):
+        os.remove(path)
+        return {"removed": 1}
+    removed = 0
+    for folder, dirs, files in os.walk(path, topdown=False):
+        job.check_cancelled()
+        for filename in files:
+            os.remove(os.path.join(folder, filename))
+        for dirname in dirs:
+            target = os.path.join(folder, dirname)
+            # Symlinks to folders are listed as folders but are removed as files
+            if os.path.islink(target):
+                os.remove(target)
+            else:
+                os.rmdir(target)
+        removed += len(files) + len(dirs)
+        job.update(progress=removed)
+    os.rmdir(path)
+    return {"removed": removed + 1}
@@ -0,0 +1,196 @@
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from betternos.cache import server_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+# ASGI scope of the request being handled, so database hooks know its route
+current_scope = ContextVar('current_scope', default=None)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, format_labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, labels=(), value=0):
+        self.values[labels] = value
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram, rendered the way Prometheus expects.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # labels -> [count per bucket..., count above, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[-2] += 1
+        series[-1] += value
+
+    def samples(self):
+        names = (*self.labels, 'le')
+        for labels, series in self.series.items():
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series[:-1]):
+                total += count
+                yield f'{self.name}_bucket', format_labels(names, (*labels, bound)), total
+            yield f'{self.name}_count', format_labels(self.labels, labels), total
+            yield f'{self.name}_sum', format_labels(self.labels, labels), series[-1]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+REQUEST_DURATION = registry.add(Histogram('betternos_request_duration_seconds', 'HTTP request latency by route.', ('method', 'route', 'status')))
+REQUESTS_IN_FLIGHT = registry.add(Gauge('betternos_requests_in_flight', 'HTTP requests being handled.'))
+SERVER_REQUESTS = registry.add(Counter('betternos_server_requests_total', 'HTTP requests by server.', ('server',)))
+SERVER_REQUEST_SECONDS = registry.add(Counter('betternos_server_request_seconds_total', 'Time spent on HTTP requests by server.', ('server',)))
+REQUEST_BYTES = registry.add(Counter('betternos_request_bytes_total', 'Request body bytes read by route.', ('route',)))
+RESPONSE_BYTES = registry.add(Counter('betternos_response_bytes_total', 'Response body bytes written by route.', ('route',)))
+DB_QUERY_DURATION = registry.add(Histogram('betternos_db_query_duration_seconds', 'Database statement time by route and statement.', ('route', 'statement'), DB_BUCKETS))
+SERVERS = registry.add(Gauge('betternos_servers', 'Registered servers by state.', ('state',)))
+JOBS = registry.add(Gauge('betternos_jobs', 'Background jobs by state.', ('state',)))
+DB_WRITES = registry.add(Gauge('betternos_db_writer', 'Database writer counters.', ('counter',)))
+
+
+def route_name(scope):
+    """
+    The path template of the route a request matched, to keep label values bounded.
+    """
+    if scope is None:
+        return 'background'
+    route = scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
+
+
+class InstrumentMiddleware:
+    """
+    ASGI middleware recording latency, in-flight requests and body bytes
+    per route, and latency per server for the /{name}/... routes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+        sizes = [0, 0]
+
+        async def receive_counted():
+            message = await receive()
+            if message['type'] == 'http.request':
+                sizes[0] += len(message.get('body', b''))
+            return message
+
+        async def send_counted(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            elif message['type'] == 'http.response.body':
+                sizes[1] += len(message.get('body', b''))
+            await send(message)
+
+        token = current_scope.set(scope)
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            current_scope.reset(token)
+            elapsed = time.perf_counter() - start
+            route = route_name(scope)
+            REQUEST_DURATION.observe((scope['method'], route, status[0]), elapsed)
+            REQUEST_BYTES.inc((route,), sizes[0])
+            RESPONSE_BYTES.inc((route,), sizes[1])
+            server = scope.get('path_params', {}).get('name')
+            # Only known servers, so made-up names cannot grow the label set
+            if route.startswith('/{name}/') and server in server_cache.servers:
+                SERVER_REQUESTS.inc((server,))
+                SERVER_REQUEST_SECONDS.inc((server,), elapsed)
+
+
+def instrument_engine(engine):
+    """
+    Time every statement run through an engine, by the route that ran it.
+    """
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        DB_QUERY_DURATION.observe((route_name(current_scope.get()), kind), elapsed)
+
+    @event.listens_for(engine.sync_engine, 'handle_error')
+    def on_error(context):
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
@@ -0,0 +1,275 @@
+import logging
+import time
+import uuid
+import asyncio
+import threading
+from functools import partial
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert
+from betternos.db import writer
+from betternos.models import JobRecord
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = 4  # jobs running at once, across all servers
+JOB_FLUSH_INTERVAL = 1  # seconds between writes of job progress to the database
+JOB_RETENTION = 7 * 24 * 3600  # seconds finished jobs are kept
+JOB_LIST_LIMIT = 50  # jobs returned by a listing by default
+
+ACTIVE_STATES = ('pending', 'running')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    A long-running operation on a server, run off the event loop.
+
+    The worker function receives the job and reports progress through it;
+    it should call check_cancelled() regularly.
+    """
+
+    def __init__(self, name, kind, id=None, state='pending', progress=0, total=None, message=None, result=None, created_at=None, finished_at=None):
+        self.id = id or uuid.uuid4().hex
+        self.name = name
+        self.kind = kind
+        self.state = state
+        self.progress = progress
+        self.total = total
+        self.message = message
+        self.result = result
+        self.created_at = created_at or time.time()
+        self.finished_at = finished_at
+        self.cancelled = threading.Event()
+        self.task = None
+        # Set whenever the job changes, cleared once it is written to the database
+        self.dirty = True
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            row.name, row.kind, row.id, row.state, row.progress, row.total,
+            row.message, row.result, row.created_at, row.finished_at,
+        )
+
+    def update(self, progress=None, total=None, message=None):
+        if progress is not None:
+            self.progress = progress
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        self.dirty = True
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    @property
+    def done(self):
+        return self.state not in ACTIVE_STATES
+
+    def to_row(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "kind": self.kind,
+            "state": self.state,
+            "progress": self.progress,
+            "total": self.total,
+            "message": self.message,
+            "result": self.result,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    def to_dict(self):
+        return self.to_row()
+
+
+async def save_job(db, row):
+    stmt = insert(JobRecord).values(row)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['id'],
+        set_={column: stmt.excluded[column] for column in ('state', 'progress', 'total', 'message', 'result', 'finished_at')},
+    )
+    await db.execute(stmt)
+
+
+async def delete_jobs(db, condition):
+    await db.execute(delete(JobRecord).where(condition))
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool and keeps their state in the database.
+
+    Jobs that change a server's files are serialized per server, so two
+    of them never work on the same tree at once; later ones wait as
+    pending. Progress is written in batches every JOB_FLUSH_INTERVAL
+    seconds, state changes straight away. Jobs that were still pending or
+    running when the API stopped are marked failed on the next start.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, flush_interval=JOB_FLUSH_INTERVAL):
+        self.workers = workers
+        self.flush_interval = flush_interval
+        self.executor = None
+        self.jobs = {}
+        self.locks = {}  # name -> asyncio.Lock held by the running exclusive job
+        self.task = None
+
+    async def load(self, db):
+        """
+        Load the jobs kept in the database and fail those a restart interrupted.
+        """
+        now = time.time()
+        await writer.write(delete_jobs, values=JobRecord.created_at < now - JOB_RETENTION)
+        result = await db.execute(select(JobRecord))
+        self.jobs = {row.id: Job.from_row(row) for row in result.scalars().all()}
+        for job in self.jobs.values():
+            job.dirty = False
+            if not job.done:
+                job.state = 'failed'
+                job.message = 'Interrupted by a restart.'
+                job.finished_at = now
+                job.dirty = True
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self.task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        for job in self.jobs.values():
+            job.cancel()
+        if self.executor is not None:
+            await asyncio.to_thread(self.executor.shutdown)
+            self.executor = None
+        await self.flush()
+
+    async def flush(self):
+        """
+        Queue the jobs changed since the last flush for the database writer,
+        and forget old finished ones.
+        """
+        expired = [
+            job for job in self.jobs.values()
+            if job.done and job.finished_at and job.finished_at < time.time() - JOB_RETENTION
+        ]
+        for job in expired:
+            del self.jobs[job.id]
+        dirty = [job for job in self.jobs.values() if job.dirty]
+        if not dirty and not expired:
+            return
+        for job in dirty:
+            job.dirty = False
+        writes = [writer.write(save_job, ('job', job.id), job.to_row()) for job in dirty]
+        if expired:
+            writes.append(writer.write(delete_jobs, values=JobRecord.id.in_([job.id for job in expired])))
+        await asyncio.gather(*writes)
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Error saving jobs')
+
+    async def _run(self, job, func, args, context, exclusive, resources):
+        lock = self.locks.setdefault(job.name, asyncio.Lock()) if exclusive else nullcontext()
+        started = False
+        try:
+            if exclusive and lock.locked():
+                job.update(message='Waiting for another job on this server')
+            async with lock:
+                job.check_cancelled()
+                job.state = 'running'
+                job.message = None
+                job.dirty = True
+                async with context or nullcontext():
+                    loop = asyncio.get_running_loop()
+                    started = True
+                    job.result = await loop.run_in_executor(self.executor, partial(func, job, *args))
+            job.state = 'done'
+        except (JobCancelled, asyncio.CancelledError):
+            job.state = 'cancelled'
+        except Exception as e:
+            logger.exception('Job failed', extra={'server': job.name, 'job': job.id, 'kind': job.kind})
+            job.state = 'failed'
+            job.message = str(e)
+        finally:
+            # Once func runs it owns them, and may still be using them in its thread
+            if not started:
+                for resource in resources:
+                    resource.close()
+        job.finished_at = time.time()
+        job.dirty = True
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('Error saving job', extra={'server': job.name, 'job': job.id})
+
+    def submit(self, name, kind, func, *args, context=None, exclusive=True, resources=()):
+        """
+        Queue func(job, *args) on the job pool and return the job immediately.
+        The worker runs inside the async context manager `context`, if given.
+        Exclusive jobs of a server run one at a time. `resources`, such as
+        open files among the args, are closed if the job ends before func
+        runs, for instance when it is cancelled while pending; func closes
+        them otherwise.
+        """
+        job = Job(name, kind)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, func, args, context, exclusive, resources))
+        job.task.add_done_callback(lambda task: self._dropped(job, resources))
+        return job
+
+    def _dropped(self, job, resources):
+        """
+        Finish a job whose task was cancelled before _run started.
+        """
+        if job.state != 'pending':
+            return
+        job.state = 'cancelled'
+        job.finished_at = time.time()
+        job.dirty = True
+        for resource in resources:
+            resource.close()
+
+    def get(self, name, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.name != name:
+            return None
+        return job
+
+    def list(self, name, state=None, limit=JOB_LIST_LIMIT):
+        """
+        Get the jobs of a server, newest first.
+        """
+        jobs = [j for j in self.jobs.values() if j.name == name and (state is None or j.state == state)]
+        jobs.sort(key=lambda j: j.created_at, reverse=True)
+        return jobs[:limit]
+
+    def cancel(self, job):
+        """
+        Cancel a job. A pending job is dropped at once; a running one stops
+        at its next check_cancelled().
+        """
+        job.cancel()
+        if job.state == 'pending' and job.task is not None:
+            job.task.cancel()
+
+
+job_manager = JobManager()
@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import logging
+
+LOG_LEVEL = os.environ.get('BETTERNOS_LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('BETTERNOS_LOG_FORMAT', 'json')  # 'json' or 'text'
+
+# Attributes every LogRecord has; anything else was passed in `extra`
+RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the fields passed in `extra` alongside
+    the time, level, logger and message.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def get_logger(name):
+    return logging.getLogger(f'betternos.{name}')
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """
+    Send the records of every betternos logger to stderr.
+    """
+    logger = logging.getLogger('betternos')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
@@ -0,0 +1,99 @@
+import os
+import asyncio
+
+LOG_BLOCK_SIZE = 64 * 1024  # bytes read per backwards seek
+LOG_MAX_CHUNK = 1024 * 1024  # max bytes returned by one incremental read
+LOG_MAX_LINES = 10000  # max lines a client may ask for from the end of a log
+LOG_STREAM_INTERVAL = 0.5  # seconds between checks for new log data
+
+
+def log_path(name):
+    """
+    Path of the latest.log file of a server.
+    """
+    return os.path.expanduser('~')+f'/{name}/logs/latest.log'
+
+
+def decode_lines(data):
+    """
+    Split raw log bytes into decoded lines, keeping line endings.
+    """
+    return [line.decode('utf-8', errors='replace') for line in data.splitlines(keepends=True)]
+
+
+def tail_lines(path, n=100, block_size=LOG_BLOCK_SIZE):
+    """
+    Get the last n lines of a file by seeking back from the end in blocks,
+    so only the tail of the file is ever read.
+    """
+    if n <= 0:
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b''
+        while pos > 0 and data.count(b'\n') <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return decode_lines(data)[-n:]
+
+
+def read_since(path, offset=0, inode=None, max_bytes=LOG_MAX_CHUNK):
+    """
+    Read the complete lines written to a file after a byte offset.
+
+    If the file has been rotated (different inode or smaller than the offset)
+    reading restarts from the beginning of the new file. Returns the new lines
+    along with the offset and inode to pass on the next call.
+    """
+    st = os.stat(path)
+    rotated = False
+    if (inode is not None and st.st_ino != inode) or st.st_size < offset:
+        rotated = True
+        offset = 0
+    lines = []
+    if st.st_size > offset:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(min(max_bytes, st.st_size - offset))
+        # Only hand out complete lines; a partial line is picked up next time
+        end = data.rfind(b'\n') + 1
+        if end == 0 and len(data) == max_bytes:
+            end = len(data)
+        lines = decode_lines(data[:end])
+        offset += end
+    return {"logs": lines, "offset": offset, "inode": st.st_ino, "rotated": rotated}
+
+
+async def stream_logs(path, request, lines=100, interval=LOG_STREAM_INTERVAL):
+    """
+    Server-Sent Events generator following a log file.
+
+    Sends the last lines of the file first, then every new line as it is
+    written, until the client disconnects.
+    """
+    offset = 0
+    inode = None
+    try:
+        st = await asyncio.to_thread(os.stat, path)
+        for line in await asyncio.to_thread(tail_lines, path, lines):
+            yield f'data: {line.rstrip()}\n\n'
+        offset, inode = st.st_size, st.st_ino
+    except FileNotFoundError:
+        pass
+
+    while not await request.is_disconnected():
+        try:
+            result = await asyncio.to_thread(read_since, path, offset, inode)
+        except FileNotFoundError:
+            await asyncio.sleep(interval)
+            continue
+        if result['rotated']:
+            yield 'event: rotated\ndata: \n\n'
+        for line in result['logs']:
+            yield f'data: {line.rstrip()}\n\n'
+        offset, inode = result['offset'], result['inode']
+        if not result['logs']:
+            await asyncio.sleep(interval)
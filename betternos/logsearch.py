@@ -0,0 +1,375 @@
+import logging
+import os
+import re
+import gzip
+import time
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from betternos.cache import server_cache
+from betternos.files import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = './betternos-logs.db'  # kept apart from betternos.db so bulk ingest never blocks the API's writes
+INDEX_INTERVAL = 5  # seconds between passes over the log folders
+INDEX_BATCH_LINES = 5000  # lines inserted per transaction
+SEARCH_DEFAULT_LIMIT = 100
+SEARCH_MAX_LIMIT = 1000
+SEARCH_RARE_MATCHES = 10000  # below this many full-text matches, hits are sorted rather than scanned for
+
+# [12:34:56] [Server thread/INFO]: ... (vanilla) or [12:34:56 INFO]: ... (Paper and Spigot)
+LINE_PREFIX = re.compile(rb'^\[(\d\d):(\d\d):(\d\d)(?:\.\d+)?(?: (\w+))?\](?: \[[^\]]*/(\w+)\])?')
+# Rotated logs are named after the day they were written, like 2024-05-01-3.log.gz
+ROTATED_DATE = re.compile(r'^(\d{4}-\d\d-\d\d)-\d+\.log')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS log_files (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    file TEXT NOT NULL,
+    inode INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER,
+    offset INTEGER NOT NULL DEFAULT 0,
+    day REAL,
+    last_time REAL,
+    last_level TEXT,
+    indexed_at REAL,
+    UNIQUE (name, file)
+);
+CREATE TABLE IF NOT EXISTS log_entries (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    time REAL,
+    level TEXT,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS log_entries_name_time ON log_entries (name, time, id);
+CREATE INDEX IF NOT EXISTS log_entries_file ON log_entries (file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5 (line, content='log_entries', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS log_entries_insert AFTER INSERT ON log_entries BEGIN
+    INSERT INTO log_fts (rowid, line) VALUES (new.id, new.line);
+END;
+CREATE TRIGGER IF NOT EXISTS log_entries_delete AFTER DELETE ON log_entries BEGIN
+    INSERT INTO log_fts (log_fts, rowid, line) VALUES ('delete', old.id, old.line);
+END;
+'''
+
+
+def connect(path=INDEX_PATH):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def log_dir(name):
+    return os.path.expanduser('~')+f'/{name}/logs'
+
+
+def day_changes(path, size):
+    """
+    Count the midnights the first `size` bytes of a log file span, as
+    parse_lines detects them.
+    """
+    changes = 0
+    last = None
+    with open(path, 'rb') as f:
+        for raw in f:
+            size -= len(raw)
+            if size < 0:
+                break
+            match = LINE_PREFIX.match(raw)
+            if match:
+                t = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + int(match.group(3))
+                if last is not None and t < last - 3600:
+                    changes += 1
+                last = t
+    return changes
+
+
+def file_day(filename, path, st):
+    """
+    Midnight of the day a log file starts on. Log lines only carry the time
+    of day: rotated files are named after their day. Other files, like
+    latest.log, end on the day they were last modified, so they start as
+    many days before it as midnights their lines pass.
+    """
+    match = ROTATED_DATE.match(filename)
+    if match:
+        day = datetime.strptime(match.group(1), '%Y-%m-%d')
+    else:
+        modified = datetime.fromtimestamp(st.st_mtime)
+        day = datetime(modified.year, modified.month, modified.day) - timedelta(days=day_changes(path, st.st_size))
+    return day.timestamp()
+
+
+def parse_lines(lines, day, last_time, last_level):
+    """
+    Turn raw log lines into (time, level, text) tuples. Lines without a
+    timestamp, such as stack traces, take the time and level of the line
+    before them; a time earlier than the previous one starts a new day.
+    """
+    entries = []
+    for raw in lines:
+        match = LINE_PREFIX.match(raw)
+        if match:
+            hours, minutes, seconds = int(match.group(1)), int(match.group(2)), int(match.group(3))
+            t = day + hours * 3600 + minutes * 60 + seconds
+            if last_time is not None and t < last_time - 3600:
+                day = (datetime.fromtimestamp(day) + timedelta(days=1)).timestamp()
+                t = day + hours * 3600 + minutes * 60 + seconds
+            last_time = t
+            level = match.group(5) or match.group(4)
+            last_level = level.decode().upper() if level else last_level
+        text = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+        if text:
+            entries.append((last_time if last_time is not None else day, last_level, text))
+    return entries, day, last_time, last_level
+
+
+class LogIndexer:
+    """
+    Keeps a full-text index of the current and rotated logs of every server.
+
+    Each pass stats the files in ~/{name}/logs. Files whose inode, size and
+    mtime match the index are skipped; a growing latest.log is read from
+    where the last pass stopped; new rotated .log.gz files are indexed once.
+    When latest.log is rotated its old lines are dropped, and come back
+    from the .log.gz they were rotated into. Files that disappear take
+    their lines with them.
+    """
+
+    def __init__(self, path=INDEX_PATH, interval=INDEX_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.conn = None
+        # Held by a pass for as long as it uses the connection
+        self.lock = threading.Lock()
+        self.task = None
+        self.passes = 0
+        self.last_pass = None
+
+    def open(self):
+        self.conn = connect(self.path)
+        self.conn.executescript(SCHEMA)
+
+    def start(self):
+        self.open()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.conn is not None:
+            # A cancelled pass keeps running in its thread until it finishes
+            await asyncio.to_thread(self.lock.acquire)
+            try:
+                self.conn.close()
+                self.conn = None
+            finally:
+                self.lock.release()
+
+    async def _run(self):
+        while True:
+            names = list(server_cache.servers)
+            try:
+                await asyncio.to_thread(self.index, names)
+            except Exception:
+                logger.exception('Error indexing logs')
+            await asyncio.sleep(self.interval)
+
+    def index(self, names):
+        """
+        Run one indexing pass over the logs of the given servers. Blocking.
+        """
+        with self.lock:
+            self._index(names)
+
+    def _index(self, names):
+        conn = self.conn
+        for name, in conn.execute('SELECT DISTINCT name FROM log_files').fetchall():
+            if name not in names:
+                self._drop(conn, 'name = ?', (name,))
+        for name in names:
+            self.index_server(name)
+        self.passes += 1
+        self.last_pass = time.time()
+
+    def _drop(self, conn, where, params):
+        with conn:
+            conn.execute(f'DELETE FROM log_entries WHERE file_id IN (SELECT id FROM log_files WHERE {where})', params)
+            conn.execute(f'DELETE FROM log_files WHERE {where}', params)
+
+    def index_server(self, name):
+        conn = self.conn
+        folder = log_dir(name)
+        try:
+            filenames = [f for f in os.listdir(folder) if f.endswith('.log') or f.endswith('.log.gz')]
+        except FileNotFoundError:
+            filenames = []
+        known = {row[1]: row for row in conn.execute(
+            'SELECT id, file, inode, size, mtime_ns, offset, day, last_time, last_level FROM log_files WHERE name = ?', (name,)
+        )}
+        for filename in set(known) - set(filenames):
+            self._drop(conn, 'id = ?', (known[filename][0],))
+        # Rotated files first, so lines dropped from a rotated latest.log come back in the same pass
+        for filename in sorted(filenames, key=lambda f: (not f.endswith('.gz'), f)):
+            try:
+                st = os.stat(f'{folder}/{filename}')
+            except FileNotFoundError:
+                continue
+            row = known.get(filename)
+            if row is not None and (row[2], row[3], row[4]) == (st.st_ino, st.st_size, st.st_mtime_ns):
+                continue
+            compressed = filename.endswith('.gz')
+            if row is not None and (compressed or row[2] != st.st_ino or st.st_size < row[5]):
+                self._drop(conn, 'id = ?', (row[0],))
+                row = None
+            try:
+                self.index_file(name, filename, f'{folder}/{filename}', st, row, compressed)
+            except (OSError, EOFError) as e:
+                # Usually a .log.gz still being written; it is retried next pass
+                logger.warning('Error indexing %s/%s: %s', folder, filename, e, extra={'server': name})
+
+    def index_file(self, name, filename, path, st, row, compressed):
+        conn = self.conn
+        if row is None:
+            day = file_day(filename, path, st)
+            with conn:
+                file_id = conn.execute(
+                    'INSERT INTO log_files (name, file, inode, day) VALUES (?, ?, ?, ?)',
+                    (name, filename, st.st_ino, day),
+                ).lastrowid
+            offset, last_time, last_level = 0, None, None
+        else:
+            file_id, _, _, _, _, offset, day, last_time, last_level = row
+        opener = gzip.open if compressed else open
+        with opener(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                lines = f.readlines(INDEX_BATCH_LINES * 200)
+                if not compressed and lines and not lines[-1].endswith(b'\n'):
+                    # Leave a partly written last line for the next pass
+                    lines.pop()
+                if not lines:
+                    break
+                entries, day, last_time, last_level = parse_lines(lines, day, last_time, last_level)
+                offset += sum(len(line) for line in lines)
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO log_entries (file_id, name, time, level, line) VALUES (?, ?, ?, ?, ?)',
+                        [(file_id, name, t, level, text) for t, level, text in entries],
+                    )
+                    conn.execute(
+                        'UPDATE log_files SET offset = ?, day = ?, last_time = ?, last_level = ? WHERE id = ?',
+                        (offset, day, last_time, last_level, file_id),
+                    )
+        # Only now is the file fully indexed; a pass that stopped early picks it up again
+        size = st.st_size if compressed else offset
+        with conn:
+            conn.execute(
+                'UPDATE log_files SET size = ?, mtime_ns = ?, indexed_at = ? WHERE id = ?',
+                (size if size == st.st_size else None, st.st_mtime_ns, time.time(), file_id),
+            )
+
+    def stats(self, name):
+        """
+        Get the size of the index and how far behind the logs of a server it is.
+        """
+        conn = connect(self.path)
+        try:
+            entries = conn.execute('SELECT count(*) FROM log_entries WHERE name = ?', (name,)).fetchone()[0]
+            files = conn.execute('SELECT file, offset, indexed_at FROM log_files WHERE name = ?', (name,)).fetchall()
+        finally:
+            conn.close()
+        now = time.time()
+        pending = 0
+        lag = 0
+        for filename, offset, indexed_at in files:
+            try:
+                st = os.stat(f'{log_dir(name)}/{filename}')
+            except FileNotFoundError:
+                continue
+            behind = 0 if filename.endswith('.gz') else max(0, st.st_size - offset)
+            if behind or indexed_at is None:
+                pending += behind
+                lag = max(lag, now - (indexed_at or st.st_mtime))
+        index_bytes = sum(os.path.getsize(p) for p in (self.path, self.path + '-wal') if os.path.exists(p))
+        return {
+            "entries": entries,
+            "files": len(files),
+            "pending_bytes": pending,
+            "lag_seconds": lag,
+            "index_bytes": index_bytes,
+            "last_pass": self.last_pass,
+        }
+
+
+def fts_query(text):
+    """
+    Turn free text into an FTS5 query matching lines with all its words.
+    """
+    terms = [t.replace('"', '""') for t in text.split()]
+    return ' '.join(f'"{t}"' for t in terms)
+
+
+def search_logs(name, text=None, since=None, until=None, level=None, cursor=None, limit=SEARCH_DEFAULT_LIMIT, path=INDEX_PATH):
+    """
+    Search the indexed log lines of a server, newest first.
+    Returns the hits and a cursor for the next page, or None.
+    """
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    conn = connect(path)
+    try:
+        return _search(conn, name, text, since, until, level, cursor, limit)
+    finally:
+        conn.close()
+
+
+def _search(conn, name, text, since, until, level, cursor, limit):
+    where = ['e.name = ?']
+    params = [name]
+    if since is not None:
+        where.append('e.time >= ?')
+        params.append(since)
+    if until is not None:
+        where.append('e.time < ?')
+        params.append(until)
+    if level:
+        where.append('e.level = ?')
+        params.append(level.upper())
+    if cursor:
+        after_time, after_id = decode_cursor(cursor)
+        where.append('(e.time < ? OR (e.time = ? AND e.id < ?))')
+        params.extend([after_time, after_time, after_id])
+    if text and text.strip():
+        query = fts_query(text)
+        # Let the full-text index produce the matching rows once, rather than
+        # probing it for every row of the server in time order
+        where.append('e.id IN (SELECT rowid FROM log_fts WHERE log_fts MATCH ?)')
+        params.append(query)
+        rare = conn.execute(
+            'SELECT count(*) FROM (SELECT rowid FROM log_fts WHERE log_fts MATCH ? LIMIT ?)', (query, SEARCH_RARE_MATCHES)
+        ).fetchone()[0] < SEARCH_RARE_MATCHES
+        if rare:
+            # Few matches: fetch them by rowid and sort, instead of walking
+            # the server's lines in time order until enough are found
+            where[0] = '+e.name = ?'
+    sql = (
+        f'SELECT e.id, e.time, e.level, e.line, f.file FROM log_entries e '
+        f'JOIN log_files f ON f.id = e.file_id '
+        f'WHERE {" AND ".join(where)} ORDER BY e.time DESC, e.id DESC LIMIT ?'
+    )
+    rows = conn.execute(sql, [*params, limit + 1]).fetchall()
+    hits = [{"time": t, "level": lvl, "line": line, "file": f} for _, t, lvl, line, f in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    return hits, next_cursor
+
+
+indexer = LogIndexer()
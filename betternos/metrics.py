@@ -0,0 +1,184 @@
+import logging
+import time
+import asyncio
+import psutil
+from array import array
+from sqlalchemy import select, insert
+from betternos.db import writer
+from betternos.models import ServerMetric
+from betternos.cache import server_cache
+
+logger = logging.getLogger(__name__)
+
+METRICS_INTERVAL = 5  # seconds between samples
+METRICS_HISTORY = 720  # samples kept in memory per server (1 hour at 5 seconds)
+ROLLUP_INTERVAL = 60  # seconds covered by each row of the rollup table
+ROLLUP_RETENTION = 30 * 24 * 3600  # seconds rollup rows are kept
+
+FIELDS = ('time', 'cpu', 'rss', 'threads', 'fds', 'read_bytes', 'write_bytes')
+
+
+class MetricsRing:
+    """
+    Fixed-size history of samples, stored column-wise in typed arrays.
+    """
+
+    def __init__(self, size=METRICS_HISTORY):
+        self.size = size
+        self.columns = {field: array('d', bytes(8 * size)) for field in FIELDS}
+        self.next = 0
+        self.count = 0
+
+    def append(self, sample):
+        for field, value in zip(FIELDS, sample):
+            self.columns[field][self.next] = value
+        self.next = (self.next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def _order(self):
+        start = (self.next - self.count) % self.size
+        return [(start + i) % self.size for i in range(self.count)]
+
+    def window(self, since=0):
+        """
+        Get the samples taken after `since` as a dict of columns, oldest first.
+        """
+        times = self.columns['time']
+        order = [i for i in self._order() if times[i] > since]
+        return {field: [self.columns[field][i] for i in order] for field in FIELDS}
+
+    def last(self):
+        if not self.count:
+            return None
+        i = (self.next - 1) % self.size
+        return {field: self.columns[field][i] for field in FIELDS}
+
+
+def rollup(name, series):
+    """
+    Summarise a window of samples into one rollup row.
+    """
+    n = len(series['time'])
+    return {
+        "name": name,
+        "time": series['time'][-1],
+        "samples": n,
+        "cpu_avg": sum(series['cpu']) / n,
+        "cpu_max": max(series['cpu']),
+        "rss_avg": sum(series['rss']) / n,
+        "rss_max": max(series['rss']),
+        "threads_max": max(series['threads']),
+        "fds_max": max(series['fds']),
+        "read_bytes": max(0, series['read_bytes'][-1] - series['read_bytes'][0]),
+        "write_bytes": max(0, series['write_bytes'][-1] - series['write_bytes'][0]),
+    }
+
+
+class MetricsCollector:
+    """
+    Samples CPU, memory, threads, open files and I/O of every running server
+    into per-server rings, and periodically writes per-minute rollups.
+    """
+
+    def __init__(self, interval=METRICS_INTERVAL, history=METRICS_HISTORY):
+        self.interval = interval
+        self.history = history
+        self.rings = {}
+        # psutil.Process objects are kept so cpu_percent measures between samples
+        self.procs = {}
+        self.rolled_at = time.time()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def sample(self, servers):
+        """
+        Take one sample of each (name, pid) pair. Blocking; run in a thread.
+        """
+        now = time.time()
+        procs = {}
+        for name, pid in servers:
+            process = self.procs.get(pid)
+            try:
+                if process is None:
+                    process = psutil.Process(pid)
+                    process.cpu_percent(None)
+                with process.oneshot():
+                    cpu = process.cpu_percent(None)
+                    rss = process.memory_info().rss
+                    threads = process.num_threads()
+                    try:
+                        fds = process.num_fds()
+                    except (AttributeError, psutil.AccessDenied):
+                        fds = 0
+                    try:
+                        io = process.io_counters()
+                        read_bytes, write_bytes = io.read_bytes, io.write_bytes
+                    except (AttributeError, psutil.AccessDenied):
+                        read_bytes = write_bytes = 0
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                continue
+            procs[pid] = process
+            ring = self.rings.get(name)
+            if ring is None:
+                ring = self.rings[name] = MetricsRing(self.history)
+            ring.append((now, cpu, rss, threads, fds, read_bytes, write_bytes))
+        self.procs = procs
+
+    async def _run(self):
+        while True:
+            servers = [(s.name, s.pid) for s in server_cache.servers.values() if s.pid is not None]
+            for name in [n for n in self.rings if n not in server_cache.servers]:
+                del self.rings[name]
+            try:
+                await asyncio.to_thread(self.sample, servers)
+                if time.time() - self.rolled_at >= ROLLUP_INTERVAL:
+                    await self.save_rollups()
+            except Exception:
+                logger.exception('Error collecting metrics')
+            await asyncio.sleep(self.interval)
+
+    async def save_rollups(self):
+        """
+        Write one rollup row per server for the samples since the last rollup.
+        """
+        since, self.rolled_at = self.rolled_at, time.time()
+        rows = []
+        for name, ring in self.rings.items():
+            series = ring.window(since)
+            if series['time']:
+                rows.append(rollup(name, series))
+        async def save(db, rows):
+            if rows:
+                await db.execute(insert(ServerMetric), rows)
+            await db.execute(ServerMetric.__table__.delete().where(ServerMetric.time < since - ROLLUP_RETENTION))
+
+        await writer.write(save, values=rows)
+
+    def top(self, by='cpu', limit=10):
+        """
+        Get the servers with the highest latest value of a metric.
+        """
+        latest = [(name, ring.last()) for name, ring in self.rings.items()]
+        latest = [(name, last) for name, last in latest if last is not None and last['time'] > time.time() - 3 * self.interval]
+        latest.sort(key=lambda item: item[1][by], reverse=True)
+        return [{"name": name, **last} for name, last in latest[:limit]]
+
+
+async def get_rollups(db, name, since):
+    result = await db.execute(
+        select(ServerMetric).where(ServerMetric.name == name, ServerMetric.time > since).order_by(ServerMetric.time)
+    )
+    rows = result.scalars().all()
+    columns = ('time', 'samples', 'cpu_avg', 'cpu_max', 'rss_avg', 'rss_max', 'threads_max', 'fds_max', 'read_bytes', 'write_bytes')
+    return {column: [getattr(row, column) for row in rows] for column in columns}
+
+
+collector = MetricsCollector()
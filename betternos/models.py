@@ -1,7 +1,17 @@
 
+from typing import Literal
 from pydantic import BaseModel, Field
 from betternos.db import Base
-from sqlalchemy import String, Boolean, Integer, Column
+from sqlalchemy import String, Boolean, Integer, Float, Column, JSON
+
+class ByteRangeEdit(BaseModel):
+    """
+    Model for replacing a byte range of a file.
+    """
+    start: int = Field(..., ge=0, description="Offset of the first byte to replace")
+    end: int = Field(..., ge=0, description="Offset after the last byte to replace")
+    content: str = Field("", description="Text to write in place of the range")
+
 
 class FileEditRequest(BaseModel):
     """
@@ -9,6 +19,9 @@ class FileEditRequest(BaseModel):
     """
     file_path: str = Field(..., description="Path to the file to be edited")
     content: str | None = Field(None, description="Content to be written to the file")
+    patch: str | None = Field(None, description="Unified diff to apply to the file")
+    ranges: list[ByteRangeEdit] | None = Field(None, description="Byte ranges to replace in the file")
+    if_match: str | None = Field(None, description="Only edit if the file's SHA-256 still equals this hash")
     
 
 class CreateServerRequest(BaseModel):
@@ -25,6 +38,43 @@ class ServerConfigRequest(BaseModel):
     Model for server configuration.
     """
     run_cmd: str | None = Field(None, description="Command to run the server")
+    cpu_affinity: str | None = Field(None, description="CPUs to pin the server to, e.g. \"0-3,8\"")
+    nice: int | None = Field(None, ge=-20, le=19, description="Nice level of the server process")
+    restart_policy: Literal['never', 'on-failure', 'always'] | None = Field(None, description="When to restart the server after it exits")
+    
+    
+
+class ServerAuth(BaseModel):
+    """
+    Model for a server name with its secret.
+    """
+    name: str = Field(..., description="Name of the server")
+    secret: str | None = Field(None, description="Secret key for the server")
+
+
+class BulkStatusRequest(BaseModel):
+    """
+    Model for a multi-server status request.
+    """
+    servers: list[ServerAuth] = Field(..., description="Servers to get the status of")
+    fields: list[str] | None = Field(None, description="Metrics to include (uptime, cpu, memory); all if omitted")
+    
+
+
+class CommandRequest(BaseModel):
+    """
+    Model for sending console commands to a server.
+    """
+    commands: list[str] = Field(..., description="Console commands to send, in order")
+    timeout: float = Field(0, ge=0, le=60, description="Seconds to collect the output that follows the commands")
+    wait_for: str | None = Field(None, description="Regular expression; stop collecting output at the first matching line")
+
+
+class BulkCommandRequest(CommandRequest):
+    """
+    Model for sending the same console commands to many servers.
+    """
+    servers: list[ServerAuth] = Field(..., description="Servers to send the commands to")
     
     
 # Database models
@@ -40,4 +90,56 @@ class Server(Base):
     ip = Column(String, nullable=False)
     pid = Column(Integer)
     secret = Column(String, nullable=False)
-    run_cmd = Column(String, nullable=True)
\ No newline at end of file
+    run_cmd = Column(String, nullable=True)
+    cpu_affinity = Column(String, nullable=True)
+    nice = Column(Integer, nullable=True)
+    restart_policy = Column(String, nullable=True)
+    exit_code = Column(Integer, nullable=True)
+    exit_signal = Column(Integer, nullable=True)
+
+class RegistryVersion(Base):
+    """
+    Single-row counter bumped whenever the servers table changes
+    """
+    
+    __tablename__ = "registry_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class ServerMetric(Base):
+    """
+    Model for per-minute rollups of server resource usage
+    """
+    
+    __tablename__ = "server_metrics"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, index=True, nullable=False)
+    time = Column(Float, index=True, nullable=False)
+    samples = Column(Integer, nullable=False)
+    cpu_avg = Column(Float)
+    cpu_max = Column(Float)
+    rss_avg = Column(Float)
+    rss_max = Column(Float)
+    threads_max = Column(Float)
+    fds_max = Column(Float)
+    read_bytes = Column(Float)
+    write_bytes = Column(Float)
+
+
+class JobRecord(Base):
+    """
+    Model for background jobs, so their state survives restarts
+    """
+    
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True)
+    name = Column(String, index=True, nullable=False)
+    kind = Column(String, nullable=False)
+    state = Column(String, nullable=False)
+    progress = Column(Integer)
+    total = Column(Integer)
+    message = Column(String)
+    result = Column(JSON)
+    created_at = Column(Float, index=True, nullable=False)
+    finished_at = Column(Float)
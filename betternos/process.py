@@ -0,0 +1,301 @@
+import os
+import re
+import time
+import signal
+import asyncio
+import logging
+import psutil
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_BUFFER_LINES = 1000  # lines of console output kept in memory per server
+OUTPUT_LINE_LIMIT = 1024 * 1024  # longest line kept; longer lines are truncated
+OUTPUT_SPILL = False  # also write console output to ~/{name}/logs/console.log
+OUTPUT_SPILL_BYTES = 10 * 1024 * 1024  # size at which console.log is rotated
+OUTPUT_SPILL_BACKUPS = 3  # rotated console.log files kept
+STOP_COMMANDS = ['save-all', 'stop']  # console commands sent to stop a server
+STOP_TIMEOUT = 60  # seconds to wait for exit after the stop commands
+TERM_TIMEOUT = 15  # seconds to wait for exit after SIGTERM
+KILL_TIMEOUT = 5  # seconds to wait for exit after SIGKILL
+POLL_INTERVAL = 5  # seconds, only used when a pid cannot be watched with pidfd
+
+# Processes started by this API, by server name; kept after exit for their output
+processes = {}
+# Stop pipelines in progress, by server name
+stopping = {}
+# Pid of the last process of each server stopped on request, so its exit is not treated as a crash
+stop_requested = {}
+
+
+def pid_alive(pid):
+    """
+    Check whether a pid is a live, non-zombie process.
+    """
+    try:
+        process = psutil.Process(pid)
+        return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+async def wait_pid(pid):
+    """
+    Wait for a pid that is not our child to exit, through a pidfd registered
+    with the event loop, or by polling where pidfd is unavailable.
+    """
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        fd = None
+    if fd is None:
+        while pid_alive(pid):
+            await asyncio.sleep(POLL_INTERVAL)
+        return
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+    loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+    try:
+        # A pidfd only becomes readable once the process is gone
+        if pid_alive(pid):
+            await exited
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+
+
+class ManagedProcess:
+    """
+    A server process started by the API, with its output drained into a
+    bounded ring buffer so the process never blocks on a full pipe.
+    """
+
+    def __init__(self, name, process, buffer_lines=OUTPUT_BUFFER_LINES, spill=OUTPUT_SPILL):
+        self.name = name
+        self.process = process
+        self.pid = process.pid
+        # (sequence number, stream, line) tuples, oldest first
+        self.output = deque(maxlen=buffer_lines)
+        self.seq = 0
+        # Futures resolved when the next output line arrives
+        self.waiters = []
+        self.input_lock = asyncio.Lock()
+        self.spill = None
+        if spill:
+            self.spill = self._open_spill()
+        self.pumps = [
+            asyncio.create_task(self._pump(process.stdout, 'stdout')),
+            asyncio.create_task(self._pump(process.stderr, 'stderr')),
+        ]
+
+    def _open_spill(self):
+        path = os.path.expanduser('~')+f'/{self.name}/logs'
+        os.makedirs(path, exist_ok=True)
+        logger = logging.getLogger(f'betternos.console.{self.name}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        handler = RotatingFileHandler(f'{path}/console.log', maxBytes=OUTPUT_SPILL_BYTES, backupCount=OUTPUT_SPILL_BACKUPS)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        return logger
+
+    async def _pump(self, stream, kind):
+        """
+        Drain a pipe line by line into the ring buffer until EOF.
+        """
+        while True:
+            try:
+                line = await stream.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                # Output ended without a newline
+                line = e.partial
+            except asyncio.LimitOverrunError:
+                # Unlike readline, readuntil leaves the buffer alone: keep the
+                # start of the line and skip the rest of it
+                line = await stream.read(OUTPUT_LINE_LIMIT)
+                dropped = await self._skip_line(stream)
+                logger.warning('Truncated a %s line of %d bytes', kind, len(line) + dropped, extra={'server': self.name})
+            if not line:
+                break
+            line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+            self.seq += 1
+            self.output.append((self.seq, kind, line))
+            if self.spill is not None:
+                self.spill.info(line)
+            waiters, self.waiters = self.waiters, []
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    @staticmethod
+    async def _skip_line(stream):
+        """
+        Discard input up to and including the next newline. Returns the
+        number of bytes discarded.
+        """
+        dropped = 0
+        while True:
+            try:
+                return dropped + len(await stream.readuntil(b'\n'))
+            except asyncio.IncompleteReadError as e:
+                return dropped + len(e.partial)
+            except asyncio.LimitOverrunError:
+                dropped += len(await stream.read(OUTPUT_LINE_LIMIT))
+
+    async def send(self, *commands):
+        """
+        Write console commands to the process's stdin in one write.
+        Returns the sequence number of the last output line before them.
+        """
+        stdin = self.process.stdin
+        if stdin is None or stdin.is_closing():
+            raise RuntimeError('Console input is closed.')
+        async with self.input_lock:
+            stdin.write(''.join(f'{c}\n' for c in commands).encode('utf-8'))
+            await stdin.drain()
+            return self.seq
+
+    async def collect(self, since, timeout, pattern=None):
+        """
+        Collect the output lines after sequence number `since` for up to
+        timeout seconds, stopping early at a line matching pattern.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        regex = re.compile(pattern) if pattern else None
+        lines = []
+        while True:
+            for seq, kind, line in self.output:
+                if seq > since:
+                    lines.append({"seq": seq, "stream": kind, "line": line})
+                    since = seq
+                    if regex is not None and regex.search(line):
+                        return lines, True
+            remaining = deadline - loop.time()
+            if remaining <= 0 or not self.running and self.process.stdout.at_eof():
+                return lines, False
+            waiter = loop.create_future()
+            self.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    @property
+    def running(self):
+        return self.process.returncode is None
+
+    def lines(self, n=100, since=None):
+        """
+        Get buffered output lines, either the last n or those after a sequence number.
+        """
+        if since is not None:
+            entries = [e for e in self.output if e[0] > since]
+        else:
+            entries = list(self.output)[-n:] if n > 0 else []
+        return [{"seq": seq, "stream": kind, "line": line} for seq, kind, line in entries]
+
+    async def wait(self):
+        """
+        Wait for the process to exit and its output to be drained.
+        """
+        code = await self.process.wait()
+        await asyncio.gather(*self.pumps, return_exceptions=True)
+        if self.spill is not None:
+            for handler in list(self.spill.handlers):
+                self.spill.removeHandler(handler)
+                handler.close()
+        return code
+
+
+async def start_process(name, command, cwd):
+    """
+    Start a server process with its output pumped into memory.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        cwd=cwd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        limit=OUTPUT_LINE_LIMIT,
+    )
+    managed = ManagedProcess(name, process)
+    processes[name] = managed
+    return managed
+
+
+def get_process(name, pid=None):
+    """
+    Get the managed process of a server, optionally only if it has the given pid.
+    """
+    managed = processes.get(name)
+    if managed is not None and pid is not None and managed.pid != pid:
+        return None
+    return managed
+
+
+async def wait_exit(name, pid, timeout):
+    """
+    Wait up to timeout seconds for a server process to exit.
+    """
+    managed = get_process(name, pid)
+    waiter = asyncio.shield(managed.process.wait()) if managed is not None else wait_pid(pid)
+    try:
+        await asyncio.wait_for(waiter, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def _stop(name, pid, timeout, term_timeout):
+    timeline = []
+
+    def step(action, **data):
+        timeline.append({"time": time.time(), "action": action, **data})
+
+    managed = get_process(name, pid)
+    if managed is not None:
+        try:
+            await managed.send(*STOP_COMMANDS)
+            step('console', commands=STOP_COMMANDS)
+            if await wait_exit(name, pid, timeout):
+                step('exited')
+                return {"exited": True, "timeline": timeline}
+        except (RuntimeError, ConnectionError) as e:
+            step('console-failed', error=str(e))
+
+    for sig, wait in ((signal.SIGTERM, term_timeout), (signal.SIGKILL, KILL_TIMEOUT)):
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            step('exited')
+            return {"exited": True, "timeline": timeline}
+        step(sig.name.lower())
+        if await wait_exit(name, pid, wait):
+            step('exited')
+            return {"exited": True, "timeline": timeline}
+    step('gave-up')
+    return {"exited": False, "timeline": timeline}
+
+
+def stop_process(name, pid, timeout=STOP_TIMEOUT, term_timeout=TERM_TIMEOUT):
+    """
+    Stop a server: send the stop commands to its console, wait for it to
+    exit, then escalate to SIGTERM and finally SIGKILL of its process group.
+
+    Returns a task resolving to whether the process exited and a timeline of
+    the steps taken. A stop already in progress is reused.
+    """
+    stop_requested[name] = pid
+    task = stopping.get(name)
+    if task is None:
+        task = asyncio.create_task(_stop(name, pid, timeout, term_timeout))
+        stopping[name] = task
+        task.add_done_callback(lambda _: stopping.pop(name, None))
+    return task
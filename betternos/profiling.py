@@ -0,0 +1,121 @@
+import os
+import sys
+import asyncio
+import threading
+import tracemalloc
+from collections import Counter
+
+ADMIN_TOKEN = os.environ.get('BETTERNOS_ADMIN_TOKEN')  # profiling is disabled unless set
+PROFILE_MAX_DURATION = 120  # seconds
+PROFILE_INTERVAL = 0.005  # seconds between stack samples
+PROFILE_TOP = 25  # entries in the summaries
+TRACEMALLOC_FRAMES = 10  # frames kept per allocation while tracing
+
+
+class ProfileBusy(Exception):
+    pass
+
+
+# Only one capture at a time; a second would skew the first
+capturing = threading.Lock()
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})'
+
+
+def sample_stacks(stop, interval=PROFILE_INTERVAL):
+    """
+    Sample the stacks of all other threads until stop is set.
+    Returns a Counter of stacks, root first, joined with ';'.
+    """
+    stacks = Counter()
+    own = threading.get_ident()
+    while not stop.wait(interval):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            stacks[';'.join(reversed(names))] += 1
+    return stacks
+
+
+async def cpu_profile(duration, interval=PROFILE_INTERVAL, top=PROFILE_TOP):
+    """
+    Sample the stacks of every thread of this worker for `duration` seconds.
+
+    Returns the functions seen most often at the top of a stack (self) and
+    anywhere in it (total), plus the stacks in the collapsed format read by
+    flamegraph tools.
+    """
+    stop = threading.Event()
+    task = asyncio.create_task(asyncio.to_thread(sample_stacks, stop, interval))
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        stop.set()
+    stacks = await task
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+        names = stack.split(';')
+        own[names[-1]] += count
+        for name in set(names):
+            total[name] += count
+    samples = sum(stacks.values())
+    return {
+        "samples": samples,
+        "self": [{"function": f, "samples": n, "share": n / samples} for f, n in own.most_common(top)],
+        "total": [{"function": f, "samples": n, "share": n / samples} for f, n in total.most_common(top)],
+        "collapsed": '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common()),
+    }
+
+
+async def memory_profile(duration, top=PROFILE_TOP):
+    """
+    Trace allocations for `duration` seconds with tracemalloc.
+
+    Returns the lines that grew most over the window and the largest
+    holders of traced memory at its end.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    try:
+        before = await asyncio.to_thread(tracemalloc.take_snapshot)
+        await asyncio.sleep(duration)
+        after = await asyncio.to_thread(tracemalloc.take_snapshot)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+    growth = await asyncio.to_thread(after.compare_to, before, 'lineno')
+    largest = await asyncio.to_thread(after.statistics, 'lineno')
+    return {
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "growth": [
+            {"location": str(s.traceback), "size_diff": s.size_diff, "count_diff": s.count_diff, "size": s.size}
+            for s in growth[:top]
+        ],
+        "largest": [{"location": str(s.traceback), "size": s.size, "count": s.count} for s in largest[:top]],
+    }
+
+
+async def capture(kind, duration):
+    """
+    Run one profile of the given kind ('cpu' or 'memory'), refusing to
+    overlap with another capture.
+    """
+    if not capturing.acquire(blocking=False):
+        raise ProfileBusy('A profile is already being captured.')
+    try:
+        if kind == 'cpu':
+            return await cpu_profile(duration)
+        return await memory_profile(duration)
+    finally:
+        capturing.release()
@@ -0,0 +1,114 @@
+import logging
+import time
+import asyncio
+from collections import deque
+from betternos.cache import server_cache
+from betternos.process import stop_requested
+from betternos.scheduler import scheduler, launch_server
+
+logger = logging.getLogger(__name__)
+
+RESTART_BACKOFF = 1  # seconds before the second restart in a row, doubled after each one
+RESTART_BACKOFF_MAX = 300  # longest wait between restarts
+CRASH_LOOP_RESTARTS = 5  # restarts within the window that park a server
+CRASH_LOOP_WINDOW = 600  # seconds
+
+
+class RestartManager:
+    """
+    Carries out the restart policy of servers when the supervisor reports an exit.
+
+    An exit is restarted straight away the first time, then with an
+    exponential backoff. Every automatic restart counts, clean exits included,
+    so a server exiting 0 right after it starts does not loop either. A server
+    exiting CRASH_LOOP_RESTARTS times within CRASH_LOOP_WINDOW seconds is
+    parked until it is started by hand.
+    """
+
+    def __init__(self):
+        self.restarts = {}  # name -> deque of exits that were restarted
+        self.parked = set()
+        self.pending = {}  # name -> scheduled restart task
+
+    def reset(self, name):
+        """
+        Forget the restarts of a server and cancel its pending restart.
+        """
+        self.restarts.pop(name, None)
+        self.parked.discard(name)
+        task = self.pending.pop(name, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    def cancel(self):
+        for task in self.pending.values():
+            task.cancel()
+        self.pending = {}
+
+    def status(self, name):
+        return {
+            "recent_restarts": len(self.restarts.get(name, ())),
+            "parked": name in self.parked,
+            "restart_pending": name in self.pending,
+        }
+
+    def backoff(self, restarts):
+        if restarts <= 1:
+            return 0
+        return min(RESTART_BACKOFF * 2 ** (restarts - 2), RESTART_BACKOFF_MAX)
+
+    async def on_exit(self, name, pid, returncode):
+        """
+        Supervisor exit callback: record the exit and restart if the policy says so.
+        """
+        exit_code = returncode if returncode is not None and returncode >= 0 else None
+        exit_signal = -returncode if returncode is not None and returncode < 0 else None
+        entry = server_cache.servers.get(name)
+        if entry is None:
+            return
+        await server_cache.save(name, exit_code=exit_code, exit_signal=exit_signal)
+
+        if stop_requested.get(name) == pid:
+            return
+        policy = entry.restart_policy or 'never'
+        # Exits of processes we did not start have no known code; count them as failures
+        failed = returncode != 0
+        if policy == 'never' or (policy == 'on-failure' and not failed):
+            return
+
+        now = time.time()
+        restarts = self.restarts.setdefault(name, deque())
+        restarts.append(now)
+        while restarts and restarts[0] < now - CRASH_LOOP_WINDOW:
+            restarts.popleft()
+        if len(restarts) >= CRASH_LOOP_RESTARTS:
+            logger.warning('Server exited %d times in %ss, not restarting it', len(restarts), CRASH_LOOP_WINDOW, extra={'server': name})
+            self.parked.add(name)
+            return
+        delay = self.backoff(len(restarts))
+        logger.info('Restarting server in %ss', delay, extra={'server': name})
+        self.pending[name] = asyncio.create_task(self._restart(name, delay))
+
+    async def _restart(self, name, delay):
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            # Once the launch begins it is no longer cancelled by reset(), which
+            # could leave a started process unrecorded; it shows as launching instead
+            if self.pending.get(name) is asyncio.current_task():
+                del self.pending[name]
+            entry = server_cache.servers.get(name)
+            if entry is None or entry.pid is not None or name in scheduler.launching:
+                return
+            # The backoff already spaces restarts out; the start stagger would add seconds to it
+            await launch_server(entry, wait=True, stagger=False)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Error restarting server', extra={'server': name})
+        finally:
+            if self.pending.get(name) is asyncio.current_task():
+                del self.pending[name]
+
+
+restarter = RestartManager()
@@ -0,0 +1,187 @@
+import logging
+import os
+import re
+import asyncio
+import psutil
+from betternos.cache import server_cache
+from betternos.process import start_process
+from betternos.supervisor import supervisor
+from betternos.utils import server_command
+
+logger = logging.getLogger(__name__)
+
+HOST_RESERVED = 2 * 1024 ** 3  # memory kept free for the OS and the API
+DEFAULT_HEAP = 2 * 1024 ** 3  # memory assumed for commands without -Xmx
+HEAP_OVERHEAD = 1.25  # JVM memory use relative to its -Xmx (metaspace, stacks, buffers)
+MAX_CONCURRENT_STARTS = 2  # servers launched within one stagger window
+START_STAGGER = 5  # seconds a launch holds its start slot
+QUEUE_TIMEOUT = 600  # seconds a queued launch waits for memory
+
+UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+XMX = re.compile(r'^-Xmx(\d+)([kKmMgGtT]?)$')
+
+
+class AdmissionError(Exception):
+    pass
+
+
+def command_memory(command):
+    """
+    Estimate the memory a server command will commit from its -Xmx option.
+    """
+    heap = DEFAULT_HEAP
+    for arg in command:
+        match = XMX.match(arg)
+        if match:
+            heap = int(match.group(1)) * UNITS[match.group(2).lower()]
+    return int(heap * HEAP_OVERHEAD)
+
+
+def parse_cpus(spec):
+    """
+    Parse a CPU list such as "0-3,8" into a list of CPU numbers.
+    """
+    cpus = []
+    for part in spec.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def apply_placement(pid, cpu_affinity=None, nice=None):
+    """
+    Pin a process to CPUs and set its nice level, where supported.
+    """
+    process = psutil.Process(pid)
+    try:
+        if cpu_affinity:
+            process.cpu_affinity(parse_cpus(cpu_affinity))
+        if nice is not None:
+            process.nice(nice)
+    except (AttributeError, ValueError, psutil.AccessDenied) as e:
+        logger.warning('Error applying CPU placement: %s', e, extra={'pid': pid})
+
+
+class Scheduler:
+    """
+    Admission control in front of server launches.
+
+    Every running server commits the memory of its -Xmx (plus overhead);
+    a launch that would commit more than the host has is rejected or queued
+    until enough servers exit. Launches are also staggered, so a mass restart
+    only starts MAX_CONCURRENT_STARTS servers per START_STAGGER seconds.
+    """
+
+    def __init__(self, max_starts=MAX_CONCURRENT_STARTS, stagger=START_STAGGER):
+        self.max_starts = max_starts
+        self.stagger = stagger
+        self.starts = None
+        self.changed = None
+        self.pending = {}  # name -> memory reserved for a launch in progress
+        self.queued = set()
+        self.launching = set()  # names with a launch requested and not finished, queued or not
+
+    def start(self):
+        self.starts = asyncio.Semaphore(self.max_starts)
+        self.changed = asyncio.Condition()
+
+    def capacity(self):
+        return psutil.virtual_memory().total - HOST_RESERVED
+
+    def committed(self):
+        running = sum(
+            command_memory(server_command(s.name, s.run_cmd))
+            for s in server_cache.servers.values()
+            if s.pid is not None and s.name not in self.pending
+        )
+        return running + sum(self.pending.values())
+
+    def status(self):
+        capacity = self.capacity()
+        committed = self.committed()
+        return {
+            "capacity": capacity,
+            "committed": committed,
+            "available": capacity - committed,
+            "starting": list(self.pending),
+            "queued": list(self.queued),
+        }
+
+    async def admit(self, name, need, wait=False, timeout=QUEUE_TIMEOUT):
+        """
+        Reserve memory for a launch, waiting for it if wait is set.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        async with self.changed:
+            while self.committed() + need > self.capacity():
+                remaining = deadline - loop.time()
+                if not wait or remaining <= 0:
+                    raise AdmissionError(f'Not enough memory: needs {need} bytes, {self.capacity() - self.committed()} available.')
+                self.queued.add(name)
+                try:
+                    await asyncio.wait_for(self.changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self.queued.discard(name)
+            self.pending[name] = need
+
+    async def notify(self, *args):
+        """
+        Wake queued launches; also used as a supervisor exit callback.
+        """
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def launch(self, name, run_cmd, cwd, save, cpu_affinity=None, nice=None, wait=False, timeout=QUEUE_TIMEOUT, stagger=True):
+        """
+        Admit, start and place a server process, then record it with
+        save(pid). Returns the managed process. Without `stagger` the launch
+        does not wait for a start slot; memory admission still applies.
+        """
+        try:
+            command = server_command(name, run_cmd)
+            await self.admit(name, command_memory(command), wait, timeout)
+            try:
+                if stagger:
+                    await self.starts.acquire()
+                    # Keep the slot for the stagger window so disks are not thrashed
+                    asyncio.get_running_loop().call_later(self.stagger, self.starts.release)
+                managed = await start_process(name, command, cwd)
+                if cpu_affinity or nice is not None:
+                    apply_placement(managed.pid, cpu_affinity, nice)
+                await save(managed.pid)
+                return managed
+            finally:
+                self.pending.pop(name, None)
+                await self.notify()
+        finally:
+            self.launching.discard(name)
+
+
+scheduler = Scheduler()
+
+
+def launch_server(entry, wait=False, stagger=True):
+    """
+    Launch a server through the scheduler and start supervising it.
+    Returns the coroutine doing the launch, which must be run.
+
+    The name is marked as launching before this returns, so a launch that
+    is only scheduled as a task is already seen by the next start request.
+    """
+    name = entry.name
+    scheduler.launching.add(name)
+
+    async def save(pid):
+        await server_cache.save(name, pid=pid)
+        supervisor.watch(name, pid)
+        logger.info('Server started', extra={'server': name, 'pid': pid})
+
+    cwd = f'{os.path.expanduser("~")}/{name}'
+    return scheduler.launch(name, entry.run_cmd, cwd, save, entry.cpu_affinity, entry.nice, wait=wait, stagger=stagger)
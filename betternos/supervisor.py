@@ -0,0 +1,129 @@
+import logging
+import asyncio
+from sqlalchemy import select
+from betternos.db import SessionLocal, writer
+from betternos.models import Server
+from betternos.process import get_process, pid_alive, wait_pid
+from betternos.utils import save_server_pids
+from betternos.cache import server_cache
+
+logger = logging.getLogger(__name__)
+
+RESCAN_INTERVAL = 60  # seconds between picking up pids started elsewhere
+
+
+class Supervisor:
+    """
+    Watches server processes and records their exit as soon as it happens.
+
+    Processes started by this API are awaited directly, other pids are watched
+    through a pidfd registered with the event loop. Exits are queued and written
+    back in a single transaction, touching only the rows that changed.
+    """
+
+    def __init__(self, rescan_interval=RESCAN_INTERVAL):
+        self.rescan_interval = rescan_interval
+        self.watchers = {}  # name -> (pid, task)
+        self.exits = None
+        self.tasks = []
+        # Coroutine functions called as callback(name, pid, returncode) after an exit is saved
+        self.exit_callbacks = []
+
+    async def start(self):
+        self.exits = asyncio.Queue()
+        await self.rescan()
+        await self._save([])
+        self.tasks = [asyncio.create_task(self._writer())]
+        if self.rescan_interval:
+            self.tasks.append(asyncio.create_task(self._rescan_loop()))
+
+    async def stop(self):
+        for _, task in self.watchers.values():
+            task.cancel()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*[t for _, t in self.watchers.values()], *self.tasks, return_exceptions=True)
+        self.watchers = {}
+        self.tasks = []
+
+    def watch(self, name, pid):
+        """
+        Start watching a server pid, replacing any previous watch of that server.
+        """
+        current = self.watchers.get(name)
+        if current is not None:
+            if current[0] == pid:
+                return
+            current[1].cancel()
+        self.watchers[name] = (pid, asyncio.create_task(self._watch(name, pid)))
+
+    def unwatch(self, name):
+        current = self.watchers.pop(name, None)
+        if current is not None:
+            current[1].cancel()
+
+    async def rescan(self):
+        """
+        Watch every server the database believes is running, and record
+        the ones that are already gone.
+        """
+        async with SessionLocal() as db:
+            result = await db.execute(select(Server.name, Server.pid).where(Server.pid.is_not(None)))
+            rows = result.all()
+        for name, pid in rows:
+            if name in self.watchers and self.watchers[name][0] == pid:
+                continue
+            if get_process(name, pid) is None and not pid_alive(pid):
+                self.exits.put_nowait((name, pid, None))
+            else:
+                self.watch(name, pid)
+
+    async def _rescan_loop(self):
+        while True:
+            await asyncio.sleep(self.rescan_interval)
+            try:
+                await self.rescan()
+            except Exception:
+                logger.exception('Error rescanning servers')
+
+    async def _watch(self, name, pid):
+        returncode = None
+        managed = get_process(name, pid)
+        if managed is not None:
+            returncode = await managed.wait()
+        else:
+            await wait_pid(pid)
+        if self.watchers.get(name, (None,))[0] == pid:
+            del self.watchers[name]
+        self.exits.put_nowait((name, pid, returncode))
+
+    async def _writer(self):
+        while True:
+            await self._save([await self.exits.get()])
+
+    async def _save(self, exits):
+        """
+        Save a batch of exits together with everything else already queued.
+        """
+        while not self.exits.empty():
+            exits.append(self.exits.get_nowait())
+        if not exits:
+            return
+        try:
+            await writer.write(save_server_pids, values=[(name, pid, None) for name, pid, _ in exits])
+        except Exception:
+            logger.exception('Error saving server status', extra={'servers': [name for name, _, _ in exits]})
+            return
+        for name, pid, returncode in exits:
+            logger.info('Server exited with code %s', returncode, extra={'server': name, 'pid': pid})
+            cached = server_cache.servers.get(name)
+            if cached is not None and cached.pid == pid:
+                server_cache.set(name, pid=None)
+            for callback in self.exit_callbacks:
+                try:
+                    await callback(name, pid, returncode)
+                except Exception:
+                    logger.exception('Error in exit callback', extra={'server': name})
+
+
+supervisor = Supervisor()
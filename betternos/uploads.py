@@ -0,0 +1,190 @@
+import os
+import json
+import uuid
+import asyncio
+import shutil
+import hashlib
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # bytes read and written at a time
+
+# Held while a resumable upload is appended to or completed, by (server, upload id)
+upload_locks = {}
+
+
+def upload_dir(name):
+    """
+    Directory holding the in-progress resumable uploads of a server.
+    """
+    return os.path.expanduser('~')+f'/.betternos/uploads/{name}'
+
+
+async def iter_file(file, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Iterate over an UploadFile in fixed-size chunks.
+    """
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def write_chunks(chunks, path, mode='wb', hasher=None):
+    """
+    Write an async iterator of byte chunks to a file without blocking the event loop.
+    Returns the number of bytes written.
+    """
+    written = 0
+    f = await asyncio.to_thread(open, path, mode)
+    try:
+        async for chunk in chunks:
+            await asyncio.to_thread(f.write, chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            written += len(chunk)
+    finally:
+        await asyncio.to_thread(f.close)
+    return written
+
+
+def file_sha256(path, chunk_size=UPLOAD_CHUNK_SIZE):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class ResumableUpload:
+    """
+    An upload sent in several requests. The received bytes are kept in a
+    .part file and the metadata in a .json file next to it, so an upload
+    can be resumed after a dropped connection or an API restart.
+    """
+
+    def __init__(self, name, id, path, filename, size=None, sha256=None):
+        self.name = name
+        self.id = id
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+
+    @property
+    def part_path(self):
+        return f'{upload_dir(self.name)}/{self.id}.part'
+
+    @property
+    def meta_path(self):
+        return f'{upload_dir(self.name)}/{self.id}.json'
+
+    @property
+    def offset(self):
+        try:
+            return os.path.getsize(self.part_path)
+        except FileNotFoundError:
+            return 0
+
+    def to_dict(self):
+        return {
+            "upload_id": self.id,
+            "path": self.path,
+            "filename": self.filename,
+            "size": self.size,
+            "sha256": self.sha256,
+            "offset": self.offset,
+        }
+
+    def save(self):
+        os.makedirs(upload_dir(self.name), exist_ok=True)
+        with open(self.meta_path, 'w') as f:
+            json.dump({k: v for k, v in self.to_dict().items() if k != 'offset'}, f)
+        if not os.path.exists(self.part_path):
+            open(self.part_path, 'wb').close()
+
+    @classmethod
+    def load(cls, name, id):
+        try:
+            with open(f'{upload_dir(name)}/{os.path.basename(id)}.json') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(name, meta['upload_id'], meta['path'], meta['filename'], meta['size'], meta['sha256'])
+
+    @property
+    def lock(self):
+        return upload_locks.setdefault((self.name, self.id), asyncio.Lock())
+
+    def discard(self):
+        for path in (self.part_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        upload_locks.pop((self.name, self.id), None)
+
+    async def append(self, offset, chunks):
+        """
+        Append chunks at the given offset, which must be the current end of the
+        part file. Returns the new offset.
+
+        Appends to one upload run one at a time. Data past the declared size
+        is never written: the request is rejected and the part file left as
+        it was before it.
+        """
+        async with self.lock:
+            self._check_open()
+            if offset != self.offset:
+                raise ValueError(f'Expected offset {self.offset}, got {offset}.')
+            if self.size is not None:
+                chunks = self._capped(chunks, self.size - offset)
+            try:
+                await write_chunks(chunks, self.part_path, 'ab')
+            except UploadTooLarge:
+                await asyncio.to_thread(os.truncate, self.part_path, offset)
+                raise
+            return self.offset
+
+    def _check_open(self):
+        # Another request may have completed or discarded it while this one waited
+        if not os.path.exists(self.meta_path):
+            raise ValueError('Upload is no longer in progress.')
+
+    @staticmethod
+    async def _capped(chunks, limit):
+        async for chunk in chunks:
+            if len(chunk) > limit:
+                raise UploadTooLarge('Upload is larger than its declared size.')
+            limit -= len(chunk)
+            yield chunk
+
+    async def complete(self, sha256=None):
+        """
+        Verify the upload and move it into place. Returns the final file path.
+        """
+        async with self.lock:
+            target = await self._complete(sha256)
+        upload_locks.pop((self.name, self.id), None)
+        return target
+
+    async def _complete(self, sha256):
+        self._check_open()
+        if self.size is not None and self.offset != self.size:
+            raise ValueError(f'Upload is incomplete ({self.offset} of {self.size} bytes).')
+        expected = sha256 or self.sha256
+        if expected is not None:
+            actual = await asyncio.to_thread(file_sha256, self.part_path)
+            if actual != expected.lower():
+                raise ValueError('Checksum mismatch.')
+        target = f'{self.path}/{self.filename}'
+        await asyncio.to_thread(shutil.move, self.part_path, target)
+        os.remove(self.meta_path)
+        return target
+
+
+def create_upload(name, path, filename, size=None, sha256=None):
+    upload = ResumableUpload(name, uuid.uuid4().hex, path, os.path.basename(filename), size, sha256)
+    upload.save()
+    return upload
@@ -1,72 +1,74 @@
 import os
-import json
+import time
 import psutil
-import requests
-import os
-from urllib.parse import urlparse
-import zipfile
-from io import BytesIO
-from sqlalchemy import select
+from sqlalchemy import update, bindparam
 from betternos.models import Server
+from betternos.cache import bump_registry_version
 
+DEFAULT_XMX = '8G'  # heap size of the default server command
 
-async def get_servers(db):
-    """
-    Get list of servers from servers.txt file.
-    """
-    servers = []
-    result = await db.execute(select(Server))
-    result = result.scalars().all()
-    for row in result:
-        server = {
-            'name': row.name,
-            'ip': row.ip,
-            'pid': row.pid,
-        }
-        servers.append(server)
-    return servers
 
-
-def refresh_servers(servers):
+def server_command(name, run_cmd=None):
     """
-    Refresh servers.
+    Get the command that runs a server.
     """
-    
-    for server in servers:
-        if server['pid']:
-            try:
-                process = psutil.Process(server['pid'])
-                if not process.is_running() or process.status() == psutil.STATUS_ZOMBIE:
-                    print(f"Process {server['pid']} is not running or is a zombie.")
-                    server['pid'] = None
-            except psutil.NoSuchProcess as e:
-                print(f"Process {server['pid']} does not exist: {e}")
-                server['pid'] = None
-    return servers
-
+    if run_cmd:
+        return run_cmd.split(' ')
+    return ['java', f'-Xmx{DEFAULT_XMX}', '-Xms1024M', '-jar', f'{os.path.expanduser("~")}/{name}/{name}.jar', 'nogui']
 
-def download_file(url, path):
 
-    response = requests.get(url)
-    response.raise_for_status()
+PROCESS_FIELDS = ('uptime', 'cpu', 'memory')
 
-    # Try to get filename from Content-Disposition header
-    cd = response.headers.get('Content-Disposition')
-    if cd and 'filename=' in cd:
-        filename = cd.split('filename=')[1].strip('\"')
-    else:
-        # Fallback: use the last part of the URL path
-        filename = os.path.basename(urlparse(url).path) or 'downloaded_file'
 
-    # Save the file
-    with open(f'{path}/{filename}', 'wb') as file:
-        file.write(response.content)
+def sample_processes(pids, fields=None):
+    """
+    Get metrics of many processes in one psutil.process_iter sweep.
+    Only the requested pids are read, each in one oneshot(). CPU percentages
+    are relative to the previous sweep. Blocking; run in a thread.
+    """
+    if fields is None:
+        fields = list(PROCESS_FIELDS)
+    pids = set(pids)
+    samples = {}
+    if not pids:
+        return samples
+    now = time.time()
+    for process in psutil.process_iter():
+        if process.pid not in pids:
+            continue
+        try:
+            with process.oneshot():
+                if process.status() == psutil.STATUS_ZOMBIE:
+                    continue
+                sample = {}
+                if 'uptime' in fields:
+                    sample['uptime'] = now - process.create_time()
+                if 'cpu' in fields:
+                    sample['cpu'] = process.cpu_percent()
+                if 'memory' in fields:
+                    sample['rss'] = process.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        samples[process.pid] = sample
+    return samples
 
-    print(f"Downloaded file as: {filename}")
-    
-    return filename
 
-def extract_zip(file, path):
-    file_data = BytesIO(file.read())
-    with zipfile.ZipFile(file_data, 'r') as zip_ref:
-        zip_ref.extractall(path)
\ No newline at end of file
+async def save_server_pids(db, changes):
+    """
+    Write changed server pids with one batched statement.
+    `changes` is a list of (name, old_pid, new_pid) tuples; a row is only
+    updated if its pid is still old_pid, so a concurrent start is not undone.
+    Runs inside the caller's transaction; the caller commits.
+    """
+    changes = [c for c in changes if c[1] != c[2]]
+    if not changes:
+        return 0
+    table = Server.__table__
+    stmt = (
+        update(table)
+        .where(table.c.name == bindparam('b_name'), table.c.pid == bindparam('b_old'))
+        .values(pid=bindparam('b_new'))
+    )
+    await db.execute(stmt, [{'b_name': name, 'b_old': old, 'b_new': new} for name, old, new in changes])
+    await bump_registry_version(db)
+    return len(changes)
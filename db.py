@@ -1,8 +0,0 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
-from sqlalchemy.orm import sessionmaker, declarative_base
-
-DATABASE_URL = "sqlite+aiosqlite:///./betternos.db"
-
-engine = create_async_engine(DATABASE_URL, echo=True)
-SessionLocal = sessionmaker(bind=engine, class_=AsyncEngine, expire_on_commit=False)
-Base = declarative_base()
\ No newline at end of file
@@ -1,26 +1,71 @@
-from fastapi import FastAPI, Header, Response, File, UploadFile, Form, Depends
+from fastapi import FastAPI, Header, Response, File, UploadFile, Form, Depends, Request, Query
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse
 from typing import Annotated
-from betternos.models import FileEditRequest, Server, CreateServerRequest, ServerConfigRequest
-import subprocess
+from betternos.models import FileEditRequest, Server, CreateServerRequest, ServerConfigRequest, BulkStatusRequest, CommandRequest, BulkCommandRequest
 import os
-import signal
-import psutil
-import shutil
-from betternos.utils import get_servers, download_file, extract_zip
+import json
+import time
+import asyncio
+from betternos.utils import sample_processes, server_command
+from betternos.scheduler import scheduler, launch_server, apply_placement, AdmissionError
+from betternos.restart import restarter
+from betternos.extract import extract_and_remove, extract_upload
+from betternos.download import download_file
+from betternos.jobs import job_manager, JOB_LIST_LIMIT
+from betternos.backup import create_snapshot, restore_snapshot, list_snapshots, load_snapshot, delete_snapshot, prune_snapshots, collect_garbage, saving_paused, BACKUP_KEEP
+from betternos.logs import log_path, tail_lines, read_since, stream_logs, LOG_MAX_LINES
+from betternos.logsearch import indexer, search_logs, SEARCH_DEFAULT_LIMIT
+from betternos.process import get_process, stop_process, stopping, STOP_TIMEOUT
+from betternos.supervisor import supervisor
+from betternos.cache import server_cache
+from betternos.metrics import collector, get_rollups
+from betternos.files import remove_path, scan_dir, list_dir, read_preview, file_etag, last_modified, not_modified, LIST_DEFAULT_LIMIT, PREVIEW_MAX_BYTES
+from betternos.edits import edit_file as write_file_edit, content_hash, EditConflict
+from betternos.uploads import iter_file, write_chunks, create_upload, ResumableUpload
 from sqlalchemy.ext.asyncio import AsyncSession
-from betternos.db import SessionLocal, engine, Base
+from betternos.db import SessionLocal, engine, Base, add_missing_columns, writer
+from betternos.logger import get_logger, setup_logging
+from betternos.instrument import InstrumentMiddleware, instrument_engine, registry, SERVERS, JOBS, DB_WRITES
+from betternos.profiling import capture, ProfileBusy, ADMIN_TOKEN, PROFILE_MAX_DURATION
+from betternos.federation import federation, FederationMiddleware, AgentUnavailable, valid_agent_token
 from contextlib import asynccontextmanager
-from sqlalchemy.future import select
 
+setup_logging()
+logger = get_logger('api')
+instrument_engine(engine)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         # Create the database tables
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+    writer.start()
+    async with SessionLocal() as db:
+        await server_cache.load(db)
+        await job_manager.load(db)
+    job_manager.start()
+    scheduler.start()
+    supervisor.exit_callbacks.append(scheduler.notify)
+    supervisor.exit_callbacks.append(restarter.on_exit)
+    await supervisor.start()
+    collector.start()
+    indexer.start()
+    federation.start()
     yield
+    await federation.stop()
+    await indexer.stop()
+    await collector.stop()
+    await supervisor.stop()
+    supervisor.exit_callbacks.remove(scheduler.notify)
+    supervisor.exit_callbacks.remove(restarter.on_exit)
+    restarter.cancel()
+    await job_manager.stop()
+    await writer.stop()
     
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(FederationMiddleware)
+app.add_middleware(InstrumentMiddleware)
 
 async def get_db():
     """
@@ -31,16 +76,10 @@ async def get_db():
         
         
 @app.get("/")
-async def read_root(db: AsyncSession = Depends(get_db)):
+async def read_root():
     """
     Root endpoint that returns a welcome message.
     """
-    servers = []
-    result = await db.execute(select(Server).where(Server.name == 'server'))
-    print(result)
-    entry = result.scalar_one_or_none()
-    print(entry)
-    
     return {"message": "Welcome to the BetterNos API"}
         
     
@@ -49,9 +88,7 @@ async def root(name: str, db: Annotated[AsyncSession, Depends(get_db)], secret:
     """
     Root endpoint that returns a replies to a ping.
     """
-    entry = await db.execute(select(Server).where(Server.name == name))
-    
-    entry = entry.scalar_one_or_none()
+    entry = await server_cache.get(db, name)
 
     if entry is None:
         return {"message": "Server not found.", "success": False}
@@ -62,56 +99,64 @@ async def root(name: str, db: Annotated[AsyncSession, Depends(get_db)], secret:
     
 
 @app.post('/{name}/start-server', status_code=200)
-async def start_server(name: str, db: Annotated[AsyncSession, Depends(get_db)], response: Response, secret: Annotated[str | None, Header()] = None):
+async def start_server(name: str, db: Annotated[AsyncSession, Depends(get_db)], response: Response, queue: bool = False, secret: Annotated[str | None, Header()] = None):
     """
     Start a server.
-    """
-    print(f'Starting server {name}')
-    print(f'Secret: {secret}')
 
-    entry = await db.execute(select(Server).where(Server.name == name))
-    entry = entry.scalar_one_or_none()
+    Launches go through the scheduler: if the host does not have the memory
+    for the server's -Xmx it is rejected with 503, or with `queue` started in
+    the background once enough memory is free.
+    """
+    entry = await server_cache.get(db, name)
     if entry is None:
-        print(f'Server {name} not found')
+        logger.info('Server not found', extra={'server': name})
         response.status_code = 404
         return {"message": "Server not found.", "success": False}
     
     if secret != entry.secret:
-        print(f'Invalid secret {secret}')
+        logger.warning('Invalid secret', extra={'server': name})
         response.status_code = 401
         return {"message": "Invalid secret.", "success": False}
-    command = ['java', '-Xmx8G', '-Xms1024M', '-jar', f'{os.path.expanduser("~")}/{name}/{name}.jar', 'nogui']
-    if entry.run_cmd:
-        command = entry.run_cmd.split(' ')
     
-    if entry.pid:
-        print(f'Server {name} is already running')
+    if entry.pid or name in stopping or name in scheduler.launching:
+        logger.info('Server is already running', extra={'server': name})
         response.status_code = 400
         return {"message": "Server is already running.", "success": False}
     
+    restarter.reset(name)
+    launch = launch_server(entry, wait=queue)
+    if queue:
+        task = asyncio.create_task(launch)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception() is None or logger.error('Error starting server: %s', t.exception(), extra={'server': name}))
+        response.status_code = 202
+        return {"message": "Server queued", "success": True}
+    
     try:
-        process = subprocess.Popen(command, start_new_session=True, cwd=f'{os.path.expanduser("~")}/{name}', stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-        entry.pid = process.pid
-        await db.commit()
-        await db.refresh(entry)
-        print(f'Server started with PID {process.pid}')
+        await launch
         response.status_code = 200
         return {"message": "Server started successfully", "success": True}
+    except AdmissionError as e:
+        response.status_code = 503
+        logger.warning('Server not admitted: %s', e, extra={'server': name})
+        return {"message": str(e), "success": False}
     except Exception as e:
         response.status_code = 500
-        print(f'Error starting server: {e}')
+        logger.exception('Error starting server', extra={'server': name})
         return {"error": str(e)}
     
 
 @app.post('/{name}/stop-server')
-async def stop_server(name: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+async def stop_server(name: str, response: Response, db: Annotated[AsyncSession, Depends(get_db)], wait: bool = False, timeout: int = STOP_TIMEOUT, secret: Annotated[str | None, Header()] = None):
     """
-    Stop a server in a tmux session.
+    Stop a server.
+
+    The stop commands are written to the server console first; if it has not
+    exited after `timeout` seconds it gets SIGTERM and then SIGKILL. The server
+    is only recorded as stopped once it has exited. With `wait` the request
+    returns when the stop is complete, otherwise as soon as it has started.
     """
-    entry = await db.execute(select(Server).where(Server.name == name))
-    entry = entry.scalar_one_or_none()
+    entry = await server_cache.get(db, name)
     if entry is None:
-        print(f'Server {name} not found')
         return {"message": "Server not found.", "success": False}
 
     
@@ -119,62 +164,288 @@ async def stop_server(name: str, db: Annotated[AsyncSession, Depends(get_db)], s
         return {"message": "Invalid secret.", "success": False}
     
     if entry.pid is None:
-        print(f'Server {name} is already stopped')
+        # A restart waiting out its backoff, or a parked server, is stopped by forgetting it
+        restart_pending = restarter.status(name)['restart_pending']
+        restarter.reset(name)
+        if restart_pending:
+            logger.info('Pending restart cancelled', extra={'server': name})
+            return {"message": "Pending restart cancelled.", "success": True}
+        if name in scheduler.launching:
+            response.status_code = 409
+            return {"message": "Server is starting.", "success": False}
+        logger.info('Server is already stopped', extra={'server': name})
         return {"message": "Server is already stopped.", "success": False}
     
     try:
-        process = psutil.Process(entry.pid)
-        # Check if the process is running
-        if process.is_running():
-            # Terminate the process
-            os.killpg(entry.pid, signal.SIGTERM)
-            entry.pid = None
-            await db.commit()
-            
-            return {"message": "Server stopped successfully", "success": True}
-        else:
-            return {"message": "Process is not running.", "success": False}
+        pid = entry.pid
+        task = stop_process(name, pid, timeout)
+        if not wait:
+            response.status_code = 202
+            return {"message": "Server is stopping", "success": True}
+        result = await task
+        if not result['exited']:
+            response.status_code = 500
+            return {"message": "Server did not stop.", "success": False, "timeline": result['timeline']}
+        if entry.pid == pid:
+            await server_cache.save(name, pid=None)
+        return {"message": "Server stopped successfully", "success": True, "timeline": result['timeline']}
     except Exception as e:
         return {"error": str(e), "success": False}
     
+async def run_commands(name, pid, request):
+    """
+    Send console commands to a running server and collect the output that follows.
+    """
+    managed = get_process(name, pid)
+    if pid is None or managed is None or not managed.running:
+        return {"message": "Server console is not available.", "success": False}
+    try:
+        since = await managed.send(*request.commands)
+    except (RuntimeError, ConnectionError) as e:
+        return {"message": str(e), "success": False}
+    output, matched = [], False
+    if request.timeout:
+        output, matched = await managed.collect(since, request.timeout, request.wait_for)
+    return {"message": "Commands sent", "success": True, "output": output, "matched": matched}
+
+
+@app.post('/{name}/command')
+async def send_command(name: str, request: CommandRequest, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Send console commands to a server.
+
+    The output printed in the following `timeout` seconds (or up to the first
+    line matching `wait_for`) is returned. Output of other commands sent at
+    the same time may be included.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    return await run_commands(name, entry.pid, request)
+
+
+@app.post('/servers-command')
+async def send_commands(request: BulkCommandRequest, db: Annotated[AsyncSession, Depends(get_db)]):
+    """
+    Send the same console commands to many servers concurrently.
+    """
+    entries = await server_cache.get_many(db, [s.name for s in request.servers])
+    local, remote = federation.group(request.servers, entries)
+    
+    async def send(auth):
+        entry = entries.get(auth.name)
+        if entry is None:
+            return {"message": "Server not found.", "success": False}
+        if auth.secret != entry.secret:
+            return {"message": "Invalid secret.", "success": False}
+        return await run_commands(auth.name, entry.pid, request)
+    
+    # Servers on other hosts get the commands from their agent, all agents at once
+    body = request.model_dump()
+    calls = {agent: ('POST', '/servers-command', {'json': {**body, 'servers': [a.model_dump() for a in auths]}}) for agent, auths in remote.items()}
+    results, replies = await asyncio.gather(
+        asyncio.gather(*[send(auth) for auth in local]),
+        federation.fan_out(calls, federation.timeout + request.timeout),
+    )
+    servers = {auth.name: result for auth, result in zip(local, results)}
+    for agent, auths in remote.items():
+        for auth in auths:
+            servers[auth.name] = replies[agent].get('servers', {}).get(auth.name, replies[agent])
+    return {"servers": servers, "success": True}
+
+
+@app.post('/servers-status')
+async def servers_status(request: BulkStatusRequest, db: Annotated[AsyncSession, Depends(get_db)]):
+    """
+    Get the status of many servers at once.
+    """
+    entries = await server_cache.get_many(db, [s.name for s in request.servers])
+    local, remote = federation.group(request.servers, entries)
+    calls = {agent: ('POST', '/servers-status', {'json': {'servers': [a.model_dump() for a in auths], 'fields': request.fields}}) for agent, auths in remote.items()}
+    replies = await federation.fan_out(calls) if calls else {}
+    pids = [entries[a.name].pid for a in local if a.name in entries and entries[a.name].pid is not None]
+    samples = await asyncio.to_thread(sample_processes, pids, request.fields) if request.fields != [] else {}
+    
+    servers = {}
+    for agent, auths in remote.items():
+        for auth in auths:
+            servers[auth.name] = replies[agent].get('servers', {}).get(auth.name, replies[agent])
+    for auth in local:
+        entry = entries.get(auth.name)
+        if entry is None:
+            servers[auth.name] = {"message": "Server not found.", "success": False}
+        elif auth.secret != entry.secret:
+            servers[auth.name] = {"message": "Invalid secret.", "success": False}
+        else:
+            servers[auth.name] = {"running": entry.pid is not None, "pid": entry.pid, **samples.get(entry.pid, {}), "success": True}
+    return {"servers": servers, "success": True}
+    
+
+@app.get('/{name}/metrics')
+async def server_metrics(name: str, db: Annotated[AsyncSession, Depends(get_db)], window: int = 300, rollup: bool = False, secret: Annotated[str | None, Header()] = None):
+    """
+    Get the resource usage of a server over the last `window` seconds.
+
+    Recent samples come from memory; with `rollup` the per-minute rollups
+    stored in the database are returned instead, for longer windows.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    since = time.time() - window
+    if rollup:
+        series = await get_rollups(db, name, since)
+    else:
+        ring = collector.rings.get(name)
+        series = ring.window(since) if ring is not None else {}
+    return {"metrics": series, "running": entry.pid is not None, "interval": collector.interval, "success": True}
+
+
+@app.get('/metrics-top')
+async def metrics_top(response: Response, by: str = 'cpu', limit: int = 10, agent_token: Annotated[str | None, Header()] = None):
+    """
+    Get the servers using the most of a resource right now.
+    Needs the agent-token header to match BETTERNOS_AGENT_TOKEN.
+    """
+    if not valid_agent_token(agent_token):
+        response.status_code = 403
+        return {"message": "Invalid agent token.", "success": False}
+    if by not in ('cpu', 'rss', 'threads', 'fds'):
+        return {"message": "Invalid metric.", "success": False}
+    servers = collector.top(by, limit)
+    if federation.agents:
+        calls = {agent: ('GET', '/metrics-top', {'params': {'by': by, 'limit': limit}}) for agent in federation.agents.values()}
+        for agent, reply in (await federation.fan_out(calls)).items():
+            servers += [{**server, "agent": agent.address} for server in reply.get('servers', [])]
+        servers = sorted(servers, key=lambda server: server[by], reverse=True)[:limit]
+    return {"servers": servers, "success": True}
+
+
 @app.get('/{name}/get-status')
-async def get_logs(name: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+async def get_logs(name: str, db: Annotated[AsyncSession, Depends(get_db)], lines: Annotated[int, Query(ge=0, le=LOG_MAX_LINES)] = 100, offset: int | None = None, inode: int | None = None, source: str = 'log', secret: Annotated[str | None, Header()] = None):
     """
     Get logs from latest.log file.
+
+    Returns the last `lines` lines by default. When `offset` is given only the
+    lines written after that byte offset are returned, together with the new
+    offset and inode to send on the next call.
+
+    With `source=output` the lines come from the in-memory console buffer of
+    the running process instead, and `offset` is the last sequence number seen.
     """
-    entry = await db.execute(select(Server).where(Server.name == name))
-    entry = entry.scalar_one_or_none()
+    entry = await server_cache.get(db, name)
     if entry is None:
         return {"message": "Server not found.", "success": False}
     
     if secret != entry.secret:
         return {"message": "Invalid secret.", "success": False}
     
-    command = ['java', '-Xmx8G', '-Xms1024M', '-jar', f'{os.path.expanduser("~")}/{name}/{name}.jar', 'nogui']
-    if entry.run_cmd:
-        command = entry.run_cmd.split(' ')
+    command = server_command(name, entry.run_cmd)
     
-    logs = []
+    data = {"logs": []}
+    if source == 'output':
+        managed = get_process(name, entry.pid)
+        if managed is not None:
+            output = managed.lines(lines, offset)
+            data = {"logs": output, "offset": output[-1]['seq'] if output else offset}
+        return {**data, "success": True, "running": entry.pid is not None, "command": command}
     try:
-        with open(os.path.expanduser('~')+f'/{name}/logs/latest.log', 'r') as f:
-            logs = f.readlines()
+        if offset is not None:
+            data = await asyncio.to_thread(read_since, log_path(name), offset, inode)
+        else:
+            data = {"logs": await asyncio.to_thread(tail_lines, log_path(name), lines)}
     except FileNotFoundError as fnf:
-        print(f'Error: {fnf}')
+        logger.debug('No log file: %s', fnf, extra={'server': name})
         
-    # Get last 100 lines
-    logs = logs[-100:]
-    return {"logs": logs, "success": True, "running": entry.pid is not None, "command": command}
+    return {**data, "success": True, "running": entry.pid is not None, "command": command}
+
+
+@app.get('/{name}/stream-logs')
+async def stream_server_logs(name: str, request: Request, db: Annotated[AsyncSession, Depends(get_db)], lines: Annotated[int, Query(ge=0, le=LOG_MAX_LINES)] = 100, secret: Annotated[str | None, Header()] = None):
+    """
+    Stream latest.log as Server-Sent Events.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        return {"message": "Server not found.", "success": False}
     
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
     
+    return StreamingResponse(stream_logs(log_path(name), request, lines), media_type='text/event-stream')
+    
+    
+@app.get('/{name}/search-logs')
+async def search_server_logs(
+        response: Response,
+        name: str,
+        db: Annotated[AsyncSession, Depends(get_db)],
+        q: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        level: str | None = None,
+        cursor: str | None = None,
+        limit: int = SEARCH_DEFAULT_LIMIT,
+        secret: Annotated[str | None, Header()] = None
+    ):
+    """
+    Search the current and rotated logs of a server, newest first.
+
+    `q` matches lines containing all of its words; `since` and `until` are
+    unix timestamps; `level` is INFO, WARN, ERROR etc. Pass the returned
+    `cursor` to get the next page.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    try:
+        hits, next_cursor = await asyncio.to_thread(search_logs, name, q, since, until, level, cursor, limit)
+    except ValueError as e:
+        response.status_code = 400
+        return {"message": str(e), "success": False}
+    return {"success": True, "data": hits, "cursor": next_cursor}
+
+
+@app.get('/{name}/log-index')
+async def log_index_status(response: Response, name: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Get the size of the log search index and how far behind the logs it is.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    return {"success": True, "data": await asyncio.to_thread(indexer.stats, name)}
+
+
 @app.get('/{name}/get-files')
-async def get_files(name: str, db: Annotated[AsyncSession, Depends(get_db)], path: str = None, secret: Annotated[str | None, Header()] = None):
+async def get_files(name: str, db: Annotated[AsyncSession, Depends(get_db)], path: str = None, max_bytes: int = PREVIEW_MAX_BYTES, secret: Annotated[str | None, Header()] = None):
     """
     Get files and folders.
+
+    Files are returned as a text preview of at most `max_bytes`; use
+    /{name}/download-file for the raw content.
     """
     if path is None:
         path = '/'
-    entry = await db.execute(select(Server).where(Server.name == name))
-    entry = entry.scalar_one_or_none()
+    entry = await server_cache.get(db, name)
     if entry is None:
         return {"message": "Server not found.", "success": False}
     
@@ -185,14 +456,18 @@ async def get_files(name: str, db: Annotated[AsyncSession, Depends(get_db)], pat
     if os.path.exists(path):
         content = None
         if os.path.isfile(path):
-            with open(path, 'r') as f:
-                try:
-                    content = f.read()
-                    print(f'File content: {content}')
-                    return {"content": content, "success": True}
-                except Exception as e:
-                    print(f'Error reading file: {e}')
-                    return {"message": "Error reading file.", "success": False}
+            try:
+                content, truncated = await asyncio.to_thread(read_preview, path, min(max_bytes, PREVIEW_MAX_BYTES))
+                data = {"content": content, "truncated": truncated, "size": os.path.getsize(path), "success": True}
+                if not truncated:
+                    # Hash to send back as if_match when saving an edit
+                    data["hash"] = content_hash(content.encode('utf-8'))
+                return data
+            except UnicodeDecodeError:
+                return {"message": "File is not a text file.", "success": False}
+            except Exception:
+                logger.exception('Error reading file', extra={'server': name})
+                return {"message": "Error reading file.", "success": False}
         elif os.path.isdir(path):
             files = os.listdir(path)
             return {"files": files, "success": True}
@@ -202,14 +477,104 @@ async def get_files(name: str, db: Annotated[AsyncSession, Depends(get_db)], pat
         return {"message": "Path does not exist.", "success": False}
     
     
+@app.get('/{name}/download-file')
+async def download_server_file(
+        response: Response,
+        name: str,
+        path: str,
+        db: Annotated[AsyncSession, Depends(get_db)],
+        if_none_match: Annotated[str | None, Header()] = None,
+        if_modified_since: Annotated[str | None, Header()] = None,
+        secret: Annotated[str | None, Header()] = None
+    ):
+    """
+    Download the raw content of a file.
+
+    The file is sent straight from disk, with Range requests, ETag and
+    Last-Modified validators and 304 responses to conditional requests.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        response.status_code = 401
+        return {"message": "Invalid secret.", "success": False}
+    
+    path = os.path.expanduser('~')+f'/{name}{path}'
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        response.status_code = 404
+        return {"message": "Path does not exist.", "success": False}
+    if not os.path.isfile(path):
+        response.status_code = 400
+        return {"message": "Path is not a file.", "success": False}
+    
+    headers = {"etag": file_etag(st), "last-modified": last_modified(st)}
+    if not_modified(st, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, stat_result=st, headers=headers, filename=os.path.basename(path), content_disposition_type='attachment')
+
+
+@app.get('/{name}/list-files')
+async def list_files(
+        response: Response,
+        name: str,
+        db: Annotated[AsyncSession, Depends(get_db)],
+        path: str = None,
+        cursor: str | None = None,
+        limit: int = LIST_DEFAULT_LIMIT,
+        sort: str = 'name',
+        order: str = 'asc',
+        filter: str | None = None,
+        depth: int = 0,
+        format: str = 'json',
+        secret: Annotated[str | None, Header()] = None
+    ):
+    """
+    List a folder with the type, size and mtime of every entry.
+
+    Results are paginated with the returned `cursor`. With `format=ndjson` the
+    whole listing is streamed one entry per line, in directory order.
+    """
+    if path is None:
+        path = '/'
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    path = os.path.expanduser('~')+f'/{name}{path}'
+    if not os.path.isdir(path):
+        return {"message": "Path is not a folder.", "success": False}
+    
+    if format == 'ndjson':
+        lines = (json.dumps(e) + '\n' for e in scan_dir(path, depth, filter))
+        return StreamingResponse(lines, media_type='application/x-ndjson')
+    
+    try:
+        files, next_cursor = await asyncio.to_thread(list_dir, path, depth, filter, sort, order == 'desc', cursor, limit)
+    except ValueError as e:
+        response.status_code = 400
+        return {"message": str(e), "success": False}
+    return {"files": files, "cursor": next_cursor, "success": True}
+    
+    
 @app.post('/{name}/edit-file')
-async def edit_file(name: str, db: Annotated[AsyncSession, Depends(get_db)], request: FileEditRequest, secret: Annotated[str | None, Header()] = None):
+async def edit_file(name: str, response: Response, db: Annotated[AsyncSession, Depends(get_db)], request: FileEditRequest, if_match: Annotated[str | None, Header()] = None, secret: Annotated[str | None, Header()] = None):
     """
     Edit a file.
+
+    The file is replaced with `content`, or changed by a unified diff in
+    `patch` or byte `ranges`, and written atomically. If `if_match` (or the
+    If-Match header) is given the edit is rejected with 409 unless it equals
+    the SHA-256 of the current content.
     """
-    print(f'Editing file {request.file_path}')
-    entry = await db.execute(select(Server).where(Server.name == name))
-    entry = entry.scalar_one_or_none()
+    entry = await server_cache.get(db, name)
     if entry is None:
         return {"message": "Server not found.", "success": False}
     
@@ -217,13 +582,25 @@ async def edit_file(name: str, db: Annotated[AsyncSession, Depends(get_db)], req
         return {"message": "Invalid secret.", "success": False}
     
     path = os.path.expanduser('~')+f'/{name}{request.file_path}'
-    if os.path.exists(path):
-        with open(path, 'w') as f:
-            try:
-                f.write(request.content)
-                return {"message": "File edited successfully", "success": True}
-            except Exception as e:
-                return {"message": "Error writing to file.", "success": False}
+    if os.path.isfile(path):
+        if request.content is None and request.patch is None and request.ranges is None:
+            response.status_code = 400
+            return {"message": "Nothing to write.", "success": False}
+        ranges = None
+        if request.ranges is not None:
+            ranges = [(r.start, r.end, r.content.encode('utf-8')) for r in request.ranges]
+        try:
+            digest = await write_file_edit(path, request.if_match or if_match, request.content, ranges, request.patch)
+            return {"message": "File edited successfully", "success": True, "hash": digest}
+        except EditConflict as e:
+            response.status_code = 409
+            return {"message": str(e), "success": False, "hash": e.current}
+        except (ValueError, UnicodeDecodeError) as e:
+            response.status_code = 400
+            return {"message": str(e), "success": False}
+        except Exception:
+            logger.exception('Error writing file', extra={'server': name})
+            return {"message": "Error writing to file.", "success": False}
     else:
         return {"message": "Path does not exist.", "success": False}
     
@@ -238,22 +615,16 @@ async def upload_file(
         folder: Annotated[str | None, Form()] = None,
         link: Annotated[str | None, Form()] = None,
         extract: Annotated[bool | None, Form()] = None,
+        sha256: Annotated[str | None, Form()] = None,
         secret: Annotated[str | None, Header()] = None
     ):
     """
     Upload a file.
+
+    A `link` is downloaded by a background job; poll /{name}/jobs/{job_id}.
     """
-    print('Received file upload request')
-    print('Data received:')
-    print(f'File path: {file_path}')
-    print(f'File: {file}')
-    print(f'Folder: {folder}')
-    print(f'Link: {link}')
-    print(f'Extract: {extract}')
-    entry = await db.execute(select(Server).where(Server.name == name))
-    entry = entry.scalar_one_or_none()
-    if entry is None:
-        print(f'Server {name} not found')
+    entry = await server_cache.get(db, name)
+    if entry is None:
         response.status_code = 404
         return {"message": "Server not found.", "success": False}
     
@@ -267,55 +638,335 @@ async def upload_file(
     if folder is not None and folder != '':
         if not os.path.exists(f'{path}/{folder}'):
             os.makedirs(f'{path}/{folder}')
-            print(f'Created folder {path}/{folder}')
             return {"message": "Folder created successfully", "success": True, 'data': folder}
         else:
-            print(f'Folder {path}/{folder} already exists')
             response.status_code = 400
             return {"message": "Folder already exists.", "success": False}
     if file is not None:
-        print(f'File: {file}')
         if extract:
+            # The spooled upload is closed with the request; a duplicate of its
+            # descriptor keeps the temporary file for the job without copying it
             try:
-                extract_zip(file.file, path)
-                return {"message": "File extracted successfully", "success": True}
-            except Exception as e:
-                print(f'Error extracting file: {e}')
-                response.status_code = 500
-                return {"message": "Error extracting file.", "success": False}
-        with open(f'{path}/{file.filename}', 'wb') as f:
-            try:
-                content = file.file.read()
-                filename = file.filename
-                f.write(content)
-                print(f'File {path} uploaded successfully')
-                return {"message": "File uploaded successfully", "success": True, 'data': filename}
-            except Exception as e:
-                print(f'Error writing file: {e}')
+                archive = await asyncio.to_thread(lambda: os.fdopen(os.dup(file.file.fileno()), 'rb'))
+            except Exception:
+                logger.exception('Error writing file', extra={'server': name})
                 response.status_code = 500
                 return {"message": "Error writing to file.", "success": False}
-    elif link is not None and link != '':
-        print(f'Link: {link}')
+            job = job_manager.submit(name, 'extract', extract_upload, archive, path, resources=[archive])
+            response.status_code = 202
+            return {"message": "Extraction started", "success": True, 'data': job.id, 'job': job.to_dict()}
         try:
-            filename = download_file(link, path)
-            if extract:
-                extract_zip(f'{path}/{filename}', path)
-                os.remove(f'{path}/{filename}')
-                return {"message": "File extracted successfully", "success": True}
-            return {"message": "File downloaded successfully", "success": True, 'data': filename}
-        except Exception as e:
-            print(f'Error downloading file: {e}')
+            filename = file.filename
+            await write_chunks(iter_file(file), f'{path}/{filename}')
+            return {"message": "File uploaded successfully", "success": True, 'data': filename}
+        except Exception:
+            logger.exception('Error writing file', extra={'server': name})
             response.status_code = 500
-            return {"message": "Error downloading file.", "success": False}
+            return {"message": "Error writing to file.", "success": False}
+    elif link is not None and link != '':
+        job = job_manager.submit(name, 'download', download_file, link, path, sha256, bool(extract))
+        return {"message": "Download started", "success": True, 'data': job.id, 'job': job.to_dict()}
+        
+        
+@app.post('/{name}/uploads')
+async def create_resumable_upload(
+        response: Response,
+        name: str,
+        db: Annotated[AsyncSession, Depends(get_db)],
+        filename: Annotated[str, Form()],
+        file_path: Annotated[str | None, Form()] = None,
+        size: Annotated[int | None, Form()] = None,
+        sha256: Annotated[str | None, Form()] = None,
+        secret: Annotated[str | None, Header()] = None
+    ):
+    """
+    Start a resumable upload. The content is then sent in chunks to
+    /{name}/uploads/{upload_id} and finished with .../complete.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    path = os.path.expanduser('~')+f'/{name}{file_path or ""}'
+    if not os.path.isdir(path):
+        response.status_code = 400
+        return {"message": "Path does not exist.", "success": False}
+    
+    upload = create_upload(name, path, filename, size, sha256)
+    return {"message": "Upload created", "success": True, "data": upload.to_dict()}
+
+
+@app.get('/{name}/uploads/{upload_id}')
+async def get_resumable_upload(response: Response, name: str, upload_id: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Get the state of a resumable upload, including the offset to resume from.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    upload = ResumableUpload.load(name, upload_id)
+    if upload is None:
+        response.status_code = 404
+        return {"message": "Upload not found.", "success": False}
+    return {"success": True, "data": upload.to_dict()}
+
+
+@app.put('/{name}/uploads/{upload_id}')
+async def append_resumable_upload(request: Request, response: Response, name: str, upload_id: str, offset: int, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Append the raw request body to a resumable upload at the given offset.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    upload = ResumableUpload.load(name, upload_id)
+    if upload is None:
+        response.status_code = 404
+        return {"message": "Upload not found.", "success": False}
+    try:
+        offset = await upload.append(offset, request.stream())
+        return {"message": "Chunk uploaded", "success": True, "data": {"offset": offset}}
+    except ValueError as e:
+        response.status_code = 409
+        return {"message": str(e), "success": False, "data": {"offset": upload.offset}}
+
+
+@app.post('/{name}/uploads/{upload_id}/complete')
+async def complete_resumable_upload(
+        response: Response,
+        name: str,
+        upload_id: str,
+        db: Annotated[AsyncSession, Depends(get_db)],
+        sha256: Annotated[str | None, Form()] = None,
+        extract: Annotated[bool | None, Form()] = None,
+        secret: Annotated[str | None, Header()] = None
+    ):
+    """
+    Verify a resumable upload and move it into the server directory.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    upload = ResumableUpload.load(name, upload_id)
+    if upload is None:
+        response.status_code = 404
+        return {"message": "Upload not found.", "success": False}
+    try:
+        target = await upload.complete(sha256)
+    except ValueError as e:
+        response.status_code = 409
+        return {"message": str(e), "success": False, "data": upload.to_dict()}
+    if extract:
+        job = job_manager.submit(name, 'extract', extract_and_remove, target, upload.path)
+        return {"message": "Extraction started", "success": True, 'data': job.id, 'job': job.to_dict()}
+    return {"message": "File uploaded successfully", "success": True, 'data': upload.filename}
+
+
+@app.delete('/{name}/uploads/{upload_id}')
+async def discard_resumable_upload(response: Response, name: str, upload_id: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Abort a resumable upload and delete what was received.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    upload = ResumableUpload.load(name, upload_id)
+    if upload is None:
+        response.status_code = 404
+        return {"message": "Upload not found.", "success": False}
+    upload.discard()
+    return {"message": "Upload discarded", "success": True}
+        
+        
+@app.get('/{name}/jobs')
+async def list_jobs(response: Response, name: str, db: Annotated[AsyncSession, Depends(get_db)], state: str | None = None, limit: int = JOB_LIST_LIMIT, secret: Annotated[str | None, Header()] = None):
+    """
+    List the background jobs of a server, newest first, optionally by state.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    return {"success": True, "data": [job.to_dict() for job in job_manager.list(name, state, limit)]}
+
+
+@app.get('/{name}/jobs/{job_id}')
+async def get_job_status(response: Response, name: str, job_id: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Get the state and progress of a background job.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    job = job_manager.get(name, job_id)
+    if job is None:
+        response.status_code = 404
+        return {"message": "Job not found.", "success": False}
+    return {"success": True, "data": job.to_dict()}
+
+
+@app.post('/{name}/jobs/{job_id}/cancel')
+async def cancel_job(response: Response, name: str, job_id: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Cancel a background job.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    job = job_manager.get(name, job_id)
+    if job is None:
+        response.status_code = 404
+        return {"message": "Job not found.", "success": False}
+    if job.done:
+        response.status_code = 400
+        return {"message": "Job already finished.", "success": False}
+    job_manager.cancel(job)
+    return {"message": "Job cancelled", "success": True}
+
+
+@app.post('/{name}/backups', status_code=202)
+async def create_backup(response: Response, name: str, db: Annotated[AsyncSession, Depends(get_db)], keep: int = BACKUP_KEEP, secret: Annotated[str | None, Header()] = None):
+    """
+    Start an incremental backup of a server. A running server has autosave
+    turned off and the world flushed for the duration of the backup.
+    Snapshots beyond the newest `keep` are removed afterwards (0 keeps all).
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    path = os.path.expanduser('~')+f'/{name}'
+    context = saving_paused(name, entry.pid) if entry.pid is not None else None
+    job = job_manager.submit(name, 'backup', create_snapshot, name, path, keep, context=context)
+    return {"message": "Backup started", "success": True, 'data': job.id, 'job': job.to_dict()}
+
+
+@app.get('/{name}/backups')
+async def get_backups(response: Response, name: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    List the backup snapshots of a server, newest first.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    return {"success": True, "data": await asyncio.to_thread(list_snapshots, name)}
+
+
+@app.post('/{name}/backups/{snapshot_id}/restore', status_code=202)
+async def restore_backup(response: Response, name: str, snapshot_id: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Restore a server directory to a snapshot. The server must be stopped.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    if entry.pid is not None:
+        response.status_code = 409
+        return {"message": "Stop the server before restoring a backup.", "success": False}
+    if await asyncio.to_thread(load_snapshot, name, snapshot_id) is None:
+        response.status_code = 404
+        return {"message": "Snapshot not found.", "success": False}
+    
+    path = os.path.expanduser('~')+f'/{name}'
+    job = job_manager.submit(name, 'restore', restore_snapshot, name, snapshot_id, path)
+    return {"message": "Restore started", "success": True, 'data': job.id, 'job': job.to_dict()}
+
+
+@app.delete('/{name}/backups/{snapshot_id}')
+async def delete_backup(response: Response, name: str, snapshot_id: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Delete a snapshot and the stored chunks only it referred to.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    if not await asyncio.to_thread(delete_snapshot, name, snapshot_id):
+        response.status_code = 404
+        return {"message": "Snapshot not found.", "success": False}
+    freed = await asyncio.to_thread(collect_garbage)
+    return {"message": "Snapshot deleted", "success": True, "data": freed}
+
+
+@app.post('/{name}/backups/prune')
+async def prune_backups(response: Response, name: str, db: Annotated[AsyncSession, Depends(get_db)], keep: int = BACKUP_KEEP, secret: Annotated[str | None, Header()] = None):
+    """
+    Keep only the newest `keep` snapshots of a server and collect unused chunks.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        response.status_code = 404
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    freed = await asyncio.to_thread(prune_snapshots, name, max(keep, 1))
+    return {"message": "Snapshots pruned", "success": True, "data": freed}
         
         
 @app.post('/{name}/delete-file')
-async def delete_file(name: str, db: Annotated[AsyncSession, Depends(get_db)], request: FileEditRequest, secret: Annotated[str | None, Header()] = None):
+async def delete_file(name: str, response: Response, db: Annotated[AsyncSession, Depends(get_db)], request: FileEditRequest, secret: Annotated[str | None, Header()] = None):
     """
-    Delete a file.
+    Delete a file. Folders are deleted by a background job.
     """
-    entry = await db.execute(select(Server).where(Server.name == name))
-    entry = entry.scalar_one_or_none()
+    entry = await server_cache.get(db, name)
     if entry is None:
         return {"message": "Server not found.", "success": False}
     
@@ -324,11 +975,12 @@ async def delete_file(name: str, db: Annotated[AsyncSession, Depends(get_db)], r
     file_path = request.file_path
     path = os.path.expanduser('~')+f'/{name}{file_path}'
     if os.path.exists(path):
+        if os.path.isdir(path):
+            job = job_manager.submit(name, 'delete-file', remove_path, path)
+            response.status_code = 202
+            return {"message": "Deletion started", "success": True, 'data': file_path.split('/')[-1], 'job': job.to_dict()}
         try:
-            if os.path.isdir(path):
-                shutil.rmtree(path)
-            else:
-                os.remove(path)
+            await asyncio.to_thread(os.remove, path)
             return {"message": "File deleted successfully", "success": True, 'data': file_path.split('/')[-1]}
         except Exception as e:
             return {"message": "Error deleting file.", "success": False}
@@ -346,60 +998,138 @@ async def create_server(request: CreateServerRequest, response: Response, db: An
     secret = request.secret
     run_cmd = request.run_cmd
     
-    print(f'Creating server {name}')
-    print(f'Secret: {secret}')
-    
-    entry = await db.execute(select(Server).where(Server.name == name))
-    if entry.scalar_one_or_none() is not None:
-        print(f'Server with name "{name}" already exists on this ip.')
+    if await server_cache.get(db, name) is not None:
         response.status_code = 400
         return {"message": "Server with name \"{name}\" already exists on this ip.", "success": False}
     
+    agent = federation.agent_for(ip)
+    if agent is not None:
+        # The agent creates the server; this instance only records where it lives
+        try:
+            reply = await federation.call(agent, 'POST', '/create-server', json=request.model_dump())
+        except AgentUnavailable:
+            response.status_code = 502
+            return {"message": "Agent unavailable.", "success": False}
+        if not reply.get('success'):
+            response.status_code = 400
+            return reply
+    
     try:
         server = Server(name=name, ip=ip, secret=secret, run_cmd=run_cmd)
-        db.add(server)
-        await db.commit()
-        await db.refresh(server)
-        os.mkdir(f'{os.path.expanduser("~")}/{name}')
-        print(f'Server {name} created successfully')
+        await server_cache.add(server)
+        if agent is None:
+            os.mkdir(f'{os.path.expanduser("~")}/{name}')
+        logger.info('Server created', extra={'server': name})
         return {"message": "Server created successfully", "success": True}
-    except Exception as e:
-        print(f'Error creating server: {e}')
+    except Exception:
+        logger.exception('Error creating server', extra={'server': name})
         response.status_code = 500
         return {"message": "Error creating server.", "success": False}
     
 
+@asynccontextmanager
+async def removing_server(name):
+    """
+    Remove a server from the registry once its files are deleted.
+    """
+    yield
+    await server_cache.remove(name)
+    logger.info('Server deleted', extra={'server': name})
+
+
 @app.get('/{name}/delete-server')
 async def delete_server(name: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
     """
-    Delete a server.
+    Delete a server. Its folder is removed by a background job, after
+    which the server is removed from the registry.
     """
-    entry = await db.execute(select(Server).where(Server.name == name))
-    entry = entry.scalar_one_or_none()
+    entry = await server_cache.get(db, name)
     if entry is None:
         return {"message": "Server not found.", "success": False}
     
     if secret != entry.secret:
         return {"message": "Invalid secret.", "success": False}
     
-    try:
-        shutil.rmtree(f'{os.path.expanduser("~")}/{name}')
-        await db.delete(entry)
-        await db.commit()
-        print(f'Server {name} deleted successfully')
-        return {"message": "Server deleted successfully", "success": True}
-    except Exception as e:
-        print(f'Error deleting server: {e}')
-        return {"message": "Error deleting server.", "success": False}
+    agent = federation.agent_for(entry.ip)
+    if agent is not None:
+        try:
+            reply = await federation.call(agent, 'GET', f'/{name}/delete-server', headers={'secret': secret})
+        except AgentUnavailable:
+            return {"message": "Agent unavailable.", "success": False}
+        # Forgotten here once the agent has taken the deletion over; the job runs there
+        if reply.get('success'):
+            await server_cache.remove(name)
+            logger.info('Server deleted', extra={'server': name, 'agent': agent.address})
+        return reply
+    
+    job = job_manager.submit(name, 'delete-server', remove_path, f'{os.path.expanduser("~")}/{name}', context=removing_server(name))
+    return {"message": "Server deletion started", "success": True, 'data': job.id, 'job': job.to_dict()}
+    
+
+@app.get('/{name}/restart-status')
+async def restart_status(name: str, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Get the restart policy of a server, its last exit and its crash-loop state.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
     
+    return {
+        "restart_policy": entry.restart_policy or 'never',
+        "exit_code": entry.exit_code,
+        "exit_signal": entry.exit_signal,
+        **restarter.status(name),
+        "success": True,
+    }
+
+
+@app.get('/scheduler')
+async def scheduler_status(response: Response, agent_token: Annotated[str | None, Header()] = None):
+    """
+    Get the memory committed by running servers and the launches waiting for it.
+    Needs the agent-token header to match BETTERNOS_AGENT_TOKEN.
+    """
+    if not valid_agent_token(agent_token):
+        response.status_code = 403
+        return {"message": "Invalid agent token.", "success": False}
+    return {**scheduler.status(), "success": True}
+
+
+@app.post('/{name}/update-config')
+async def update_config(name: str, request: ServerConfigRequest, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
+    """
+    Update the configuration of a server. Only the fields sent are changed.
+    """
+    entry = await server_cache.get(db, name)
+    if entry is None:
+        return {"message": "Server not found.", "success": False}
+    
+    if secret != entry.secret:
+        return {"message": "Invalid secret.", "success": False}
+    
+    values = request.model_dump(exclude_unset=True)
+    if not values:
+        return {"message": "Nothing to update.", "success": False}
+    try:
+        await server_cache.save(name, **values)
+        if entry.pid is not None and ('cpu_affinity' in values or 'nice' in values):
+            apply_placement(entry.pid, entry.cpu_affinity, entry.nice)
+        return {"message": "Configuration updated successfully", "success": True}
+    except Exception:
+        logger.exception('Error updating configuration', extra={'server': name})
+        return {"message": "Error updating configuration.", "success": False}
+
 
 @app.post('/{name}/update-run-cmd')
 async def update_run_cmd(name: str, request: ServerConfigRequest, db: Annotated[AsyncSession, Depends(get_db)], secret: Annotated[str | None, Header()] = None):
     """
     Update the run command of a server.
     """
-    entry = await db.execute(select(Server).where(Server.name == name))
-    entry = entry.scalar_one_or_none()
+    entry = await server_cache.get(db, name)
     if entry is None:
         return {"message": "Server not found.", "success": False}
     
@@ -407,12 +1137,103 @@ async def update_run_cmd(name: str, request: ServerConfigRequest, db: Annotated[
         return {"message": "Invalid secret.", "success": False}
     
     try:
-        print(f'Updating run command to {request.run_cmd}')
-        entry.run_cmd = request.run_cmd
-        await db.commit()
-        await db.refresh(entry)
-        print(f'Run command updated successfully')
+        await server_cache.save(name, run_cmd=request.run_cmd)
+        logger.info('Run command updated', extra={'server': name})
         return {"message": "Run command updated successfully", "success": True}
-    except Exception as e:
-        print(f'Error updating run command: {e}')
-        return {"message": "Error updating run command.", "success": False}
\ No newline at end of file
+    except Exception:
+        logger.exception('Error updating run command', extra={'server': name})
+        return {"message": "Error updating run command.", "success": False}
+        
+        
+@app.get('/cache-stats')
+async def cache_stats(response: Response, agent_token: Annotated[str | None, Header()] = None):
+    """
+    Get hit/miss counters of the server registry cache and the batching
+    counters of the database writer.
+    Needs the agent-token header to match BETTERNOS_AGENT_TOKEN.
+    """
+    if not valid_agent_token(agent_token):
+        response.status_code = 403
+        return {"message": "Invalid agent token.", "success": False}
+    return {**server_cache.stats(), "writer": writer.stats(), "success": True}
+
+
+@app.get('/fleet')
+async def fleet(response: Response, refresh: bool = False, agent_token: Annotated[str | None, Header()] = None):
+    """
+    Get the health and servers of every agent this instance coordinates.
+
+    The state cached by the last background check is returned at once;
+    with `refresh` every agent is checked first, each for at most the
+    agent timeout. Needs the agent-token header to match BETTERNOS_AGENT_TOKEN.
+    """
+    if not valid_agent_token(agent_token):
+        response.status_code = 403
+        return {"message": "Invalid agent token.", "success": False}
+    if refresh:
+        await federation.refresh()
+    local = [{"name": s.name, "running": s.pid is not None} for s in server_cache.servers.values() if federation.agent_for(s.ip) is None]
+    return {"servers": local, "agents": federation.status(), "success": True}
+
+
+@app.get('/agent-status')
+async def agent_status(response: Response, agent_token: Annotated[str | None, Header()] = None):
+    """
+    Get the servers of this instance and its memory admission state, for a coordinator.
+    Needs the agent-token header to match BETTERNOS_AGENT_TOKEN.
+    """
+    if not valid_agent_token(agent_token):
+        response.status_code = 403
+        return {"message": "Invalid agent token.", "success": False}
+    servers = [{"name": s.name, "running": s.pid is not None, "pid": s.pid} for s in server_cache.servers.values()]
+    return {"servers": servers, "scheduler": scheduler.status(), "success": True}
+
+
+@app.get('/metrics')
+async def metrics(agent_token: Annotated[str | None, Header()] = None):
+    """
+    Get request, database and job metrics in the Prometheus text format.
+    Needs the agent-token header to match BETTERNOS_AGENT_TOKEN, as the
+    per-server series name the servers.
+    """
+    if not valid_agent_token(agent_token):
+        return PlainTextResponse('Invalid agent token.\n', status_code=403)
+    running = sum(1 for server in server_cache.servers.values() if server.pid is not None)
+    SERVERS.set(('running',), running)
+    SERVERS.set(('stopped',), len(server_cache.servers) - running)
+    states = {state: 0 for state in ('pending', 'running', 'done', 'failed', 'cancelled')}
+    for job in job_manager.jobs.values():
+        states[job.state] = states.get(job.state, 0) + 1
+    for state, count in states.items():
+        JOBS.set((state,), count)
+    for counter, value in writer.stats().items():
+        DB_WRITES.set((counter,), value)
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.post('/admin/profile')
+async def profile(response: Response, kind: str = 'cpu', duration: float = 10, admin_token: Annotated[str | None, Header()] = None):
+    """
+    Profile this API worker for `duration` seconds.
+
+    A `cpu` profile samples the stacks of every thread and returns the
+    hottest functions with the stacks in collapsed (flame graph) format; a
+    `memory` profile returns the allocations that grew over the window.
+    Needs the admin-token header to match BETTERNOS_ADMIN_TOKEN.
+    """
+    if ADMIN_TOKEN is None or admin_token != ADMIN_TOKEN:
+        response.status_code = 403
+        return {"message": "Invalid admin token.", "success": False}
+    if kind not in ('cpu', 'memory'):
+        response.status_code = 400
+        return {"message": "Kind must be cpu or memory.", "success": False}
+    if not 0 < duration <= PROFILE_MAX_DURATION:
+        response.status_code = 400
+        return {"message": f"Duration must be between 0 and {PROFILE_MAX_DURATION} seconds.", "success": False}
+    try:
+        result = await capture(kind, duration)
+    except ProfileBusy as e:
+        response.status_code = 409
+        return {"message": str(e), "success": False}
+    logger.info('Captured %s profile', kind, extra={'duration': duration})
+    return {**result, "kind": kind, "duration": duration, "success": True}
@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+import betternos.models  # noqa: F401  registers the tables
+from betternos import db as database
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+async def session_factory(tmp_path, monkeypatch):
+    """
+    A fresh SQLite database with all tables, used by every session the
+    betternos modules open during the test.
+    """
+    engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path}/test.db')
+    async with engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+    factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    monkeypatch.setattr(database, 'SessionLocal', factory)
+    yield factory
+    await engine.dispose()
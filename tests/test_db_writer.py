@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from sqlalchemy import select
+from betternos.db import DatabaseWriter
+from betternos.cache import ServerCache
+from betternos.models import Server
+
+pytestmark = pytest.mark.anyio
+
+
+def recorder(calls, label):
+    async def apply(db, values):
+        calls.append((label, values))
+        return label
+    return apply
+
+
+async def test_same_apply_is_merged(session_factory):
+    writer = DatabaseWriter()
+    writer.start()
+    calls = []
+    save = recorder(calls, 'save')
+    try:
+        results = await asyncio.gather(
+            writer.write(save, 'a', {'x': 1, 'y': 1}),
+            writer.write(save, 'a', {'y': 2}),
+        )
+    finally:
+        await writer.stop()
+    assert results == ['save', 'save']
+    assert calls == [('save', {'x': 1, 'y': 2})]
+    assert writer.stats()['coalesced'] == 1
+
+
+async def test_different_apply_runs_both_in_order(session_factory):
+    writer = DatabaseWriter()
+    writer.start()
+    calls = []
+    save, remove = recorder(calls, 'save'), recorder(calls, 'remove')
+    try:
+        await asyncio.gather(
+            writer.write(save, 'a', {'x': 1}),
+            writer.write(remove, 'a', 'a'),
+            writer.write(save, 'a', {'x': 2}),
+            writer.write(save, 'a', {'y': 3}),
+        )
+    finally:
+        await writer.stop()
+    assert calls == [('save', {'x': 1}), ('remove', 'a'), ('save', {'x': 2, 'y': 3})]
+
+
+async def names(session_factory):
+    async with session_factory() as db:
+        return set((await db.execute(select(Server.name))).scalars().all())
+
+
+@pytest.mark.parametrize('order', [('remove', 'save'), ('save', 'remove')])
+async def test_server_cache_remove_and_save_in_one_batch(session_factory, monkeypatch, order):
+    from betternos import cache
+    writer = DatabaseWriter()
+    monkeypatch.setattr(cache, 'writer', writer)
+    server_cache = ServerCache()
+    await server_cache.add(Server(name='a', ip='local', secret='s', run_cmd='old'))
+    writer.start()
+    operations = {
+        'remove': lambda: server_cache.remove('a'),
+        'save': lambda: server_cache.save('a', run_cmd='new'),
+    }
+    try:
+        await asyncio.gather(*[operations[op]() for op in order])
+    finally:
+        await writer.stop()
+    # The add was committed on its own, before the writer started
+    assert writer.stats()['batches'] == 2
+    # Saving a row that is gone changes nothing; removing it always wins
+    assert await names(session_factory) == set()
+    assert 'a' not in server_cache.servers
@@ -0,0 +1,118 @@
+import io
+import os
+import hashlib
+import zipfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from betternos.download import download_file, DOWNLOAD_CHUNK_SIZE
+from betternos.jobs import Job, JobCancelled
+
+LARGE = os.urandom(3 * DOWNLOAD_CHUNK_SIZE)
+
+
+def archive():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr('world/level.dat', b'level')
+        zf.writestr('server.properties', b'motd=hi\n')
+    return buffer.getvalue()
+
+
+# path -> (extra headers, body)
+ROUTES = {
+    '/files/plugin.jar': ({}, b'jar'),
+    '/download?id=1': ({'Content-Disposition': 'attachment; filename="mods.jar"; size=3'}, b'mod'),
+    '/escape': ({'Content-Disposition': 'attachment; filename="../../evil.jar"'}, b'evil'),
+    '/large.bin': ({}, LARGE),
+    '/world.zip': ({}, archive()),
+}
+
+
+class Files(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ROUTES:
+            self.send_error(404)
+            return
+        headers, body = ROUTES[self.path]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Files)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+
+
+def test_streams_to_part_file_then_renames(server, tmp_path):
+    job = Job('srv', 'download')
+    seen = []
+    update = job.update
+
+    def record(**kwargs):
+        seen.append(sorted(os.listdir(tmp_path)))
+        update(**kwargs)
+
+    job.update = record
+    assert download_file(job, f'{server}/large.bin', str(tmp_path), hashlib.sha256(LARGE).hexdigest().upper()) == 'large.bin'
+    assert (tmp_path / 'large.bin').read_bytes() == LARGE
+    assert (job.progress, job.total) == (len(LARGE), len(LARGE))
+    assert ['large.bin.part'] in seen
+    assert os.listdir(tmp_path) == ['large.bin']
+
+
+def test_checksum_mismatch_leaves_nothing(server, tmp_path):
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        download_file(Job('srv', 'download'), f'{server}/files/plugin.jar', str(tmp_path), '0' * 64)
+    assert os.listdir(tmp_path) == []
+
+
+def test_cancel_mid_stream_removes_part_file(server, tmp_path):
+    job = Job('srv', 'download')
+    update = job.update
+
+    def cancel_after_first_chunk(progress=None, **kwargs):
+        update(progress=progress, **kwargs)
+        if progress:
+            job.cancel()
+
+    job.update = cancel_after_first_chunk
+    with pytest.raises(JobCancelled):
+        download_file(job, f'{server}/large.bin', str(tmp_path))
+    assert 0 < job.progress < len(LARGE)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('path, filename', [
+    ('/files/plugin.jar', 'plugin.jar'),
+    ('/download?id=1', 'mods.jar'),
+    ('/escape', 'evil.jar'),
+])
+def test_file_name(server, tmp_path, path, filename):
+    assert download_file(Job('srv', 'download'), f'{server}{path}', str(tmp_path)) == filename
+    assert os.listdir(tmp_path) == [filename]
+
+
+def test_http_error_is_raised(server, tmp_path):
+    with pytest.raises(Exception, match='404'):
+        download_file(Job('srv', 'download'), f'{server}/missing.jar', str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+
+def test_extract_then_remove(server, tmp_path):
+    assert download_file(Job('srv', 'download'), f'{server}/world.zip', str(tmp_path), extract=True) == 'world.zip'
+    assert sorted(os.listdir(tmp_path)) == ['server.properties', 'world']
+    assert (tmp_path / 'world' / 'level.dat').read_bytes() == b'level'
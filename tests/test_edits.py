@@ -0,0 +1,60 @@
+import difflib
+import pytest
+from betternos.edits import apply_patch, apply_ranges, edit_file, content_hash, EditConflict
+
+
+def diff(old, new):
+    return ''.join(difflib.unified_diff(old.splitlines(True), new.splitlines(True), 'a/f', 'b/f'))
+
+
+@pytest.mark.parametrize('old, new', [
+    ('a\nb\nc\n', 'a\nB\nc\n'),
+    ('a\nb\nc\n', 'x\na\nb\nc\n'),
+    ('a\nb\nc\n', 'a\nb\nc\nd\n'),
+    ('a\nb\nc\n', 'a\nc\n'),
+    ('\n'.join(f'line {i}' for i in range(40)) + '\n', '\n'.join(f'line {i}' if i % 13 else 'changed' for i in range(40)) + '\n'),
+])
+def test_apply_patch_matches_difflib(old, new):
+    assert apply_patch(old, diff(old, new)) == new
+
+
+def test_apply_patch_insert_into_empty_hunk():
+    patch = '@@ -1,0 +2,1 @@\n+inserted\n'
+    assert apply_patch('a\nb\n', patch) == 'a\ninserted\nb\n'
+
+
+def test_apply_patch_no_newline_at_end():
+    patch = '@@ -1,1 +1,1 @@\n-a\n+b\n\\ No newline at end of file\n'
+    assert apply_patch('a\n', patch) == 'b'
+
+
+def test_apply_patch_rejects_mismatched_context():
+    with pytest.raises(ValueError, match='does not apply'):
+        apply_patch('a\nb\nc\n', diff('a\nX\nc\n', 'a\nY\nc\n'))
+
+
+def test_apply_patch_rejects_out_of_order_hunks():
+    patch = '@@ -3,1 +3,1 @@\n-c\n+C\n@@ -1,1 +1,1 @@\n-a\n+A\n'
+    with pytest.raises(ValueError, match='out of order'):
+        apply_patch('a\nb\nc\n', patch)
+
+
+def test_apply_ranges():
+    assert apply_ranges(b'hello world', [(6, 11, b'there'), (0, 1, b'J')]) == b'Jello there'
+    with pytest.raises(ValueError):
+        apply_ranges(b'hello', [(0, 3, b''), (2, 4, b'')])
+    with pytest.raises(ValueError):
+        apply_ranges(b'hello', [(3, 9, b'')])
+
+
+@pytest.mark.anyio
+async def test_edit_file_checks_if_match(tmp_path):
+    path = tmp_path / 'server.properties'
+    path.write_bytes(b'motd=old\n')
+    stale = content_hash(b'something else')
+    with pytest.raises(EditConflict) as e:
+        await edit_file(str(path), stale, content='motd=new\n')
+    assert e.value.current == content_hash(b'motd=old\n')
+    digest = await edit_file(str(path), e.value.current, patch=diff('motd=old\n', 'motd=new\n'))
+    assert path.read_bytes() == b'motd=new\n'
+    assert digest == content_hash(b'motd=new\n')
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import httpx
+import pytest
+from betternos.federation import AGENT_TIMEOUT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = 'fleet-token'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_instance(tmp_path, label, agents=()):
+    """
+    Start a BetterNos instance with its own database and home directory.
+    """
+    base = tmp_path / label
+    (base / 'home').mkdir(parents=True)
+    port = free_port()
+    env = {**os.environ, 'HOME': str(base / 'home'), 'BETTERNOS_AGENT_TOKEN': TOKEN, 'BETTERNOS_AGENTS': ','.join(agents)}
+    log = open(base / 'uvicorn.log', 'wb')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', ROOT, '--host', '127.0.0.1', '--port', str(port)],
+        cwd=base, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while True:
+        try:
+            httpx.get(url, timeout=1)
+            break
+        except httpx.HTTPError:
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                raise RuntimeError((base / 'uvicorn.log').read_text())
+            time.sleep(0.1)
+    return process, f'127.0.0.1:{port}', base / 'home'
+
+
+class SlowAgent(BaseHTTPRequestHandler):
+    """
+    An agent that accepts servers but then never answers in time.
+    """
+    release = threading.Event()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('content-length', 0)))
+        if self.path != '/create-server':
+            return self.do_GET()
+        body = json.dumps({"success": True}).encode()
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.release.wait(30)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def fleet(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('fleet')
+    slow = ThreadingHTTPServer(('127.0.0.1', 0), SlowAgent)
+    threading.Thread(target=slow.serve_forever, daemon=True).start()
+    down = f'127.0.0.1:{free_port()}'
+    processes = []
+    try:
+        agent1, address1, home1 = run_instance(tmp_path, 'agent1')
+        processes.append(agent1)
+        agent2, address2, home2 = run_instance(tmp_path, 'agent2')
+        processes.append(agent2)
+        slow_address = f'127.0.0.1:{slow.server_address[1]}'
+        coordinator, address, _ = run_instance(tmp_path, 'coordinator', [address1, address2, slow_address, down])
+        processes.append(coordinator)
+        with httpx.Client(base_url=f'http://{address}', timeout=30) as client:
+            yield {
+                "client": client,
+                "agents": [address1, address2],
+                "homes": [home1, home2],
+                "slow": slow_address,
+                "down": down,
+            }
+    finally:
+        SlowAgent.release.set()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(10)
+        slow.shutdown()
+
+
+def agent_servers(address):
+    reply = httpx.get(f'http://{address}/agent-status', headers={'agent-token': TOKEN}).json()
+    return sorted(server['name'] for server in reply['servers'])
+
+
+def test_fleet_views_need_the_token(fleet):
+    client = fleet["client"]
+    assert client.get('/fleet').status_code == 403
+    assert client.get('/fleet', headers={'agent-token': 'wrong'}).status_code == 403
+    assert client.get('/fleet', headers={'agent-token': TOKEN}).status_code == 200
+
+
+def test_servers_are_created_and_routed_on_their_agent(fleet):
+    client = fleet["client"]
+    address1, address2 = fleet["agents"]
+    for name, ip in (('a', address1), ('b', address2), ('c', '127.0.0.1'), ('s', fleet["slow"])):
+        assert client.post('/create-server', json={'name': name, 'ip': ip, 'secret': name}).json()['success']
+    assert agent_servers(address1) == ['a']
+    assert agent_servers(address2) == ['b']
+
+    # The file only exists in the home directory of the first agent
+    (fleet["homes"][0] / 'a' / 'server.properties').write_text('motd=a\n')
+    reply = client.get('/a/list-files', headers={'secret': 'a'}).json()
+    assert [entry['name'] for entry in reply['files']] == ['server.properties']
+    assert client.get('/b/list-files', headers={'secret': 'b'}).json()['files'] == []
+    assert client.get('/a/ping', headers={'secret': 'wrong'}).json()['message'] == 'Invalid secret.'
+
+
+def test_servers_status_merges_agents_and_fails_fast(fleet):
+    client = fleet["client"]
+    servers = [{'name': 'a', 'secret': 'a'}, {'name': 'b', 'secret': 'wrong'}, {'name': 'c', 'secret': 'c'}, {'name': 's', 'secret': 's'}]
+    start = time.perf_counter()
+    reply = client.post('/servers-status', json={'servers': servers, 'fields': []}).json()
+    elapsed = time.perf_counter() - start
+    assert reply['servers']['a'] == {"running": False, "pid": None, "success": True}
+    assert reply['servers']['b'] == {"message": "Invalid secret.", "success": False}
+    assert reply['servers']['c'] == {"running": False, "pid": None, "success": True}
+    assert reply['servers']['s']['message'] == 'Agent unavailable.'
+    assert elapsed < AGENT_TIMEOUT + 2
+
+    # The slow agent is now failed fast instead of waited on again
+    start = time.perf_counter()
+    reply = client.post('/servers-status', json={'servers': servers, 'fields': []}).json()
+    assert reply['servers']['s']['message'] == 'Agent unavailable.'
+    assert reply['servers']['a']['success']
+    assert time.perf_counter() - start < 1
+    assert client.get('/s/ping', headers={'secret': 's'}).status_code == 502
+
+
+def test_fleet_serves_cached_agent_health(fleet):
+    client = fleet["client"]
+    headers = {'agent-token': TOKEN}
+    refreshed = client.get('/fleet', params={'refresh': True}, headers=headers).json()
+    start = time.perf_counter()
+    cached = client.get('/fleet', headers=headers).json()
+    assert time.perf_counter() - start < 1
+    assert cached['agents'] == refreshed['agents']
+    assert cached['servers'] == [{"name": "c", "running": False}]
+
+    agents = {agent['address']: agent for agent in cached['agents']}
+    address1, address2 = fleet["agents"]
+    assert agents[address1]['healthy'] and [s['name'] for s in agents[address1]['servers']] == ['a']
+    assert agents[address2]['healthy'] and [s['name'] for s in agents[address2]['servers']] == ['b']
+    assert agents[fleet["slow"]]['healthy'] is False
+    assert agents[fleet["down"]]['healthy'] is False
@@ -0,0 +1,49 @@
+import os
+import pytest
+from betternos.files import list_dir
+
+
+@pytest.fixture
+def folder(tmp_path):
+    for i in range(7):
+        path = tmp_path / f'f{i}.txt'
+        path.write_bytes(b'x' * (i * 10 % 7))
+        os.utime(path, (1000 + i, 1000 + i))
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'inner.txt').write_bytes(b'y')
+    return tmp_path
+
+
+def all_pages(path, **kwargs):
+    names = []
+    cursor = None
+    while True:
+        page, cursor = list_dir(str(path), cursor=cursor, limit=3, **kwargs)
+        names += [e['path'] for e in page]
+        if cursor is None:
+            return names
+
+
+@pytest.mark.parametrize('sort', ['name', 'size', 'mtime'])
+@pytest.mark.parametrize('reverse', [False, True])
+def test_pages_cover_every_entry_once_in_order(folder, sort, reverse):
+    names = all_pages(folder, sort=sort, reverse=reverse)
+    full, cursor = list_dir(str(folder), sort=sort, reverse=reverse, limit=100)
+    assert cursor is None
+    assert names == [e['path'] for e in full]
+    assert len(names) == len(set(names)) == 8
+
+
+def test_pages_do_not_shift_when_entries_are_added(folder):
+    first, cursor = list_dir(str(folder), limit=3)
+    (folder / 'a-new.txt').write_bytes(b'')
+    page, cursor = list_dir(str(folder), cursor=cursor, limit=100)
+    assert [e['path'] for e in first] == ['f0.txt', 'f1.txt', 'f2.txt']
+    assert [e['path'] for e in page] == ['f3.txt', 'f4.txt', 'f5.txt', 'f6.txt', 'sub']
+
+
+def test_depth_and_invalid_cursor(folder):
+    names = all_pages(folder, depth=1)
+    assert 'sub/inner.txt' in names
+    with pytest.raises(ValueError):
+        list_dir(str(folder), cursor='not-a-cursor')
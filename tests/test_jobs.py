@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import tempfile
+import pytest
+from betternos.jobs import JobManager
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_resources_of_a_job_cancelled_before_it_starts_are_closed(session_factory):
+    manager = JobManager(workers=2)
+    manager.start()
+    release = threading.Event()
+    try:
+        running = manager.submit('srv', 'extract', lambda job: release.wait(5))
+        archive = tempfile.TemporaryFile()
+        pending = manager.submit('srv', 'extract', lambda job, f: f.read(), archive, resources=[archive])
+        manager.cancel(pending)
+        await asyncio.gather(pending.task, return_exceptions=True)
+        assert pending.state == 'cancelled'
+        assert archive.closed
+        release.set()
+        await running.task
+        assert running.state == 'done'
+    finally:
+        release.set()
+        await manager.stop()
+
+
+async def test_resources_of_a_job_waiting_on_the_lock_are_closed(session_factory):
+    manager = JobManager(workers=2)
+    manager.start()
+    release = threading.Event()
+    try:
+        running = manager.submit('srv', 'extract', lambda job: release.wait(5))
+        archive = tempfile.TemporaryFile()
+        pending = manager.submit('srv', 'extract', lambda job, f: f.read(), archive, resources=[archive])
+        await asyncio.sleep(0.01)
+        assert pending.message == 'Waiting for another job on this server'
+        manager.cancel(pending)
+        await asyncio.gather(pending.task, return_exceptions=True)
+        assert pending.state == 'cancelled'
+        assert archive.closed
+        release.set()
+        await running.task
+    finally:
+        release.set()
+        await manager.stop()
+
+
+async def test_resources_are_left_to_a_job_that_ran(session_factory):
+    manager = JobManager(workers=1)
+    manager.start()
+    try:
+        archive = tempfile.TemporaryFile()
+        archive.write(b'data')
+        archive.seek(0)
+        job = manager.submit('srv', 'extract', lambda job, f: f.read().decode(), archive, resources=[archive])
+        await job.task
+        assert (job.state, job.result) == ('done', 'data')
+        assert not archive.closed
+        archive.close()
+    finally:
+        await manager.stop()
@@ -0,0 +1,36 @@
+import os
+from datetime import datetime
+from betternos.logsearch import file_day, parse_lines
+
+
+def write_log(path, lines, modified):
+    path.write_bytes(b''.join(line + b'\n' for line in lines))
+    os.utime(path, (modified.timestamp(), modified.timestamp()))
+    return os.stat(path)
+
+
+def test_rotated_file_takes_its_day_from_the_name(tmp_path):
+    path = tmp_path / '2024-05-01-2.log'
+    st = write_log(path, [b'[23:59:00] [Server thread/INFO]: a'], datetime(2024, 5, 3, 10))
+    assert file_day(path.name, path, st) == datetime(2024, 5, 1).timestamp()
+
+
+def test_latest_log_spanning_midnight_starts_the_day_before(tmp_path):
+    path = tmp_path / 'latest.log'
+    lines = [
+        b'[23:58:00] [Server thread/INFO]: before midnight',
+        b'[23:59:30] [Server thread/WARN]: still before',
+        b'[00:00:10] [Server thread/INFO]: after midnight',
+    ]
+    st = write_log(path, lines, datetime(2024, 5, 2, 0, 1))
+    day = file_day(path.name, path, st)
+    assert day == datetime(2024, 5, 1).timestamp()
+    entries, _, _, _ = parse_lines(lines, day, None, None)
+    times = [datetime.fromtimestamp(t) for t, _, _ in entries]
+    assert times == [datetime(2024, 5, 1, 23, 58), datetime(2024, 5, 1, 23, 59, 30), datetime(2024, 5, 2, 0, 0, 10)]
+
+
+def test_latest_log_within_one_day(tmp_path):
+    path = tmp_path / 'latest.log'
+    st = write_log(path, [b'[08:00:00 INFO]: a', b'[09:00:00 INFO]: b'], datetime(2024, 5, 2, 9, 5))
+    assert file_day(path.name, path, st) == datetime(2024, 5, 2).timestamp()
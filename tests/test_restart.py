@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from betternos import restart
+from betternos.cache import CachedServer
+from betternos.restart import RestartManager, CRASH_LOOP_RESTARTS
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def launches(monkeypatch):
+    """
+    Servers of a stand-in cache, with launches recorded instead of run.
+    """
+    launched = []
+    servers = {'mc': CachedServer(1, 'mc', '127.0.0.1', None, 's', 'java', restart_policy='always')}
+
+    async def save(name, **values):
+        pass
+
+    async def launch(entry, wait=False, stagger=True):
+        launched.append(entry.name)
+
+    monkeypatch.setattr(restart.server_cache, 'servers', servers)
+    monkeypatch.setattr(restart.server_cache, 'save', save)
+    monkeypatch.setattr(restart, 'launch_server', launch)
+    monkeypatch.setattr(restart, 'RESTART_BACKOFF', 0.01)
+    return launched
+
+
+async def test_clean_exits_back_off_and_park(launches):
+    restarter = RestartManager()
+    delays = []
+    for _ in range(CRASH_LOOP_RESTARTS - 1):
+        await restarter.on_exit('mc', 1, 0)
+        delays.append(restarter.backoff(len(restarter.restarts['mc'])))
+        await restarter.pending['mc']
+    assert delays == [0, 0.01, 0.02, 0.04]
+    assert launches == ['mc'] * (CRASH_LOOP_RESTARTS - 1)
+
+    await restarter.on_exit('mc', 1, 0)
+    assert restarter.status('mc') == {"recent_restarts": CRASH_LOOP_RESTARTS, "parked": True, "restart_pending": False}
+    assert len(launches) == CRASH_LOOP_RESTARTS - 1
+
+
+async def test_reset_cancels_a_restart_in_backoff(launches):
+    restarter = RestartManager()
+    await restarter.on_exit('mc', 1, 1)
+    await restarter.pending['mc']
+    await restarter.on_exit('mc', 1, 1)
+    task = restarter.pending['mc']
+    restarter.reset('mc')
+    await asyncio.gather(task, return_exceptions=True)
+    assert task.cancelled()
+    assert launches == ['mc']
+    assert restarter.status('mc') == {"recent_restarts": 0, "parked": False, "restart_pending": False}
@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import pytest
+from betternos.uploads import create_upload, ResumableUpload
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    (tmp_path / 'srv').mkdir()
+    return tmp_path
+
+
+async def body(*chunks, delay=0):
+    for chunk in chunks:
+        await asyncio.sleep(delay)
+        yield chunk
+
+
+async def test_append_and_complete(home):
+    upload = create_upload('srv', str(home / 'srv'), 'world.zip', 6, hashlib.sha256(b'abcdef').hexdigest())
+    assert await upload.append(0, body(b'abc')) == 3
+    # A retry of the same chunk is rejected, a resume from the reported offset works
+    with pytest.raises(ValueError):
+        await upload.append(0, body(b'abc'))
+    resumed = ResumableUpload.load('srv', upload.id)
+    assert await resumed.append(resumed.offset, body(b'de', b'f')) == 6
+    target = await resumed.complete()
+    assert open(target, 'rb').read() == b'abcdef'
+    assert ResumableUpload.load('srv', upload.id) is None
+
+
+async def test_concurrent_appends_at_one_offset(home):
+    upload = create_upload('srv', str(home / 'srv'), 'a.bin')
+    first = ResumableUpload.load('srv', upload.id)
+    second = ResumableUpload.load('srv', upload.id)
+    results = await asyncio.gather(
+        first.append(0, body(b'aa', b'aa', delay=0.01)),
+        second.append(0, body(b'bb', b'bb', delay=0.01)),
+        return_exceptions=True,
+    )
+    assert sorted(type(r).__name__ for r in results) == ['ValueError', 'int']
+    assert upload.offset == 4
+    assert open(upload.part_path, 'rb').read() in (b'aaaa', b'bbbb')
+
+
+async def test_append_past_declared_size_leaves_part_unchanged(home):
+    upload = create_upload('srv', str(home / 'srv'), 'a.bin', 4)
+    await upload.append(0, body(b'ab'))
+    with pytest.raises(ValueError):
+        await upload.append(2, body(b'c', b'def'))
+    assert open(upload.part_path, 'rb').read() == b'ab'
+    assert await upload.append(2, body(b'cd')) == 4
+    assert open(await upload.complete(), 'rb').read() == b'abcd'
+
+
+async def test_complete_checks_size_and_checksum(home):
+    upload = create_upload('srv', str(home / 'srv'), 'a.bin', 4)
+    await upload.append(0, body(b'ab'))
+    with pytest.raises(ValueError, match='incomplete'):
+        await upload.complete()
+    await upload.append(2, body(b'cd'))
+    with pytest.raises(ValueError, match='Checksum'):
+        await upload.complete(hashlib.sha256(b'other').hexdigest())
+    await upload.complete(hashlib.sha256(b'abcd').hexdigest())
+    with pytest.raises(ValueError):
+        await upload.complete()